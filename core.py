@@ -4,22 +4,197 @@
 
 """
 
+import weakref
+from collections import OrderedDict
 import numpy as np
-from sklearn.externals.joblib import Memory
+import scipy.sparse as sp
+import scipy.sparse.linalg as spla
+from scipy.sparse.csgraph import reverse_cuthill_mckee
 
 
-def flip(p=.5, **kwargs):
+def check_rng(rng):
+    """
+    RandomState from `rng`: numpy's global RandomState if None, a new
+    RandomState seeded with `rng` if it's an int or a sequence of ints (e.g
+    (seed, worker, shard)), and `rng` itself if it's already a RandomState.
+
+    """
+
+    if rng is None: return np.random.mtrand._rand
+    if isinstance(rng, np.random.RandomState): return rng
+    return np.random.RandomState(rng)
+
+
+def spawn_rngs(seed, n_streams):
+    """
+    Independent random streams, e.g one per parallel worker or chain: stream
+    i is a RandomState seeded with (seed..., i), so that each stream only
+    depends on the seed and on i (not on the number of streams, or on the
+    order in which they're consumed).
+
+    Parameters
+    ----------
+    seed: int, sequence of ints, RandomState or None
+        Root seed. A RandomState (or None, for fresh OS entropy) is first
+        reduced to an int drawn from it.
+
+    n_streams: int
+        Number of streams.
+
+    Returns
+    -------
+    rngs: list of n_streams RandomStates
+
+    """
+
+    if seed is None: seed = np.random.RandomState()
+    if isinstance(seed, np.random.RandomState): seed = seed.randint(2 ** 31)
+    seed = list(np.atleast_1d(seed))
+    return [np.random.RandomState(seed + [i]) for i in xrange(n_streams)]
+
+
+def _freeze(x):
+    # hashable stand-in for an argument (arrays, lists, dicts, ...)
+    if isinstance(x, np.ndarray): return (x.dtype.str, x.shape, x.tobytes())
+    if isinstance(x, (list, tuple)): return tuple(map(_freeze, x))
+    if isinstance(x, dict): return tuple(sorted(
+            (k, _freeze(v)) for k, v in x.iteritems()))
+    if isinstance(x, set): return frozenset(x)
+    return x
+
+
+class Memoized(object):
+    """
+    Function whose results are kept in memory, keyed on the call arguments
+    (see `mem`).
+
+    Attributes
+    ----------
+    cache: dict (OrderedDict, in LRU order, if maxsize is set)
+        The results, by call arguments.
+
+    """
+
+    def __init__(self, func, maxsize=None, memory=None):
+        self.func = func
+        self.maxsize = maxsize
+        self.memory = memory
+        self._func = func if memory is None else memory.cache(func)
+        self.cache = {} if maxsize is None else OrderedDict()
+        self.__doc__ = getattr(func, "__doc__", None)
+
+    def __call__(self, *args, **kwargs):
+        key = (args, tuple(sorted(kwargs.iteritems())))
+        try: hash(key)
+        except TypeError: key = _freeze(key)
+        if key in self.cache:
+            if self.maxsize is None: return self.cache[key]
+            value = self.cache[key] = self.cache.pop(key)  # most recent
+            return value
+        value = self.cache[key] = self._func(*args, **kwargs)
+        if self.maxsize is not None and len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)  # least recently used
+        return value
+
+    def reset(self):
+        """
+        Forgets the results kept in memory (not those on disk).
+
+        """
+
+        self.cache.clear()
+
+
+class MemScope(object):
+    """
+    Memoized functions which are reset together. A scope typically spans
+    one run of a generative model (a "world"): within it, a memoized
+    stochastic function is a fixed random function, e.g the strength of
+    each person; a new world starts when the scope is reset, or entered as
+    a context manager (it's also reset on exit).
+
+    """
+
+    def __init__(self):
+        self.functions = weakref.WeakSet()
+
+    def mem(self, func, maxsize=None, memory=None):
+        """
+        Memoizes a function in this scope (see `mem`).
+
+        """
+
+        memoized = Memoized(func, maxsize=maxsize, memory=memory)
+        self.functions.add(memoized)
+        return memoized
+
+    def reset(self):
+        for memoized in list(self.functions): memoized.reset()
+
+    def __enter__(self):
+        self.reset()
+        return self
+
+    def __exit__(self, *exc):
+        self.reset()
+
+
+# scope of the functions memoized without an explicit one
+default_scope = MemScope()
+
+
+def mem(func, maxsize=None, scope=None, memory=None):
+    """
+    Stochastic memoization, as in Church: the memoized function returns the
+    same value each time it's called with the same arguments, until its
+    scope is reset. E.g
+
+        strength = mem(lambda person: 10 if flip() else 5)
+
+    draws the strength of each person once.
+
+    Parameters
+    ----------
+    func: callable
+        The function to memoize. Its arguments are the keys of the cache;
+        they should be hashable, or arrays, lists, dicts or sets thereof.
+
+    maxsize: int, optional (default None)
+        If set, only the results of the maxsize most recent distinct calls
+        are kept (least recently used first out).
+
+    scope: `MemScope`, optional (default None)
+        Scope of the function; `default_scope` if None.
+
+    memory: joblib.Memory, optional (default None)
+        Second, on-disk, tier for the calls missing from memory, which
+        survives resets and processes: only use it for expensive
+        deterministic functions (it would fix a stochastic one for good).
+
+    Returns
+    -------
+    memoized: `Memoized`
+        The memoized function (`memoized.reset()` resets it alone).
+
+    """
+
+    if scope is None: scope = default_scope
+    return scope.mem(func, maxsize=maxsize, memory=memory)
+
+
+def flip(p=.5, rng=None, **kwargs):
     '''
     Bernoulli variable with parameter p
 
-    The kwargs act like a seed (when calls are cached).
+    rng is a RandomState or a seed (see `check_rng`). The kwargs act like a
+    seed (when calls are memoized, see `mem`).
 
     '''
 
-    return np.random.rand() <= p
+    return check_rng(rng).rand() <= p
 
 
-def multinomial(probs, **kwargs):
+def multinomial(probs, rng=None, **kwargs):
     '''
     Multinomial variable
 
@@ -28,52 +203,510 @@ def multinomial(probs, **kwargs):
     probs: 1D array-like
        weight of each class
 
-    The kwargs act like a seed (when calls are cached).
+    rng: RandomState or seed, optional (default None)
+       source of randomness (see `check_rng`)
+
+    The kwargs act like a seed (when calls are memoized, see `mem`).
 
     '''
 
     cs = np.cumsum(probs)  # CDF
     cs /= cs.max()  # normalization for stochasticity
 
-    return np.min(np.nonzero(np.random.rand() <= cs))
+    return np.min(np.nonzero(check_rng(rng).rand() <= cs))
+
+
+def _row_cdfs(probs, indptr):
+    """
+    CDFs of the rows of a transition table, side by side: row x of the
+    table has probabilities probs[indptr[x]:indptr[x + 1]] (CSR layout),
+    and its CDF is cdfs[indptr[x]:indptr[x + 1]], in [0, 1] (see
+    `_draw_rows`).
+
+    The cumulative sums are taken within each row, all rows at once, by
+    doubling (log2 of the longest row passes), so that the round-off error
+    of a row's CDF is relative to 1, whatever the other rows. The last
+    entry of each row is exactly 1.
+
+    """
+
+    lengths = np.diff(indptr)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    ranks = np.arange(len(rows)) - indptr[:-1][rows]  # positions in rows
+    cdfs = np.array(probs, dtype=float)
+    shift = 1
+    while shift < lengths.max():
+        # inclusive scan: add the partial sum of the `shift` entries before
+        add = np.nonzero(ranks >= shift)[0]
+        cdfs[add] += cdfs[add - shift]
+        shift *= 2
+    # normalization for stochasticity
+    cdfs /= cdfs[indptr[1:] - 1][rows]
+    return cdfs
+
+
+def _draw_rows(cdfs, indptr, x, u):
+    """
+    Slots (in cdfs) of the next states of chains in states x, given
+    uniforms u in [0, 1): for each chain, the first entry of row x whose
+    CDF exceeds u (so that zero-probability entries are never drawn).
+
+    The rows are bisected all at once, between indptr[x] and
+    indptr[x + 1] - 1: O(log k) per draw, for rows with k entries (the
+    number of vectorized steps is set by the longest of the rows).
+
+    """
+
+    lo, hi = indptr[x], indptr[x + 1] - 1  # cdfs[hi] == 1 > u
+    n_steps = int((hi - lo).max()).bit_length() if np.size(x) else 0
+    for _ in xrange(n_steps):
+        mid = (lo + hi) // 2
+        right = cdfs[mid] <= u
+        lo = np.where(right, mid + 1, lo)
+        hi = np.where(right, hi, mid)
+    return lo
+
+
+class Worlds(object):
+    """
+    A batch of possible worlds of a generative model, run at once: each
+    random choice is an array with one entry per world, and so is each
+    value computed from them. E.g
+
+        strength = worlds.mem(lambda person: np.where(worlds.flip(), 10, 5))
+
+    draws the strength of each person once per world.
+
+    Parameters
+    ----------
+    n_worlds: int
+        Number of worlds.
+
+    rng: RandomState or seed, optional (default None)
+        Source of the random choices (see `check_rng`).
+
+    Attributes
+    ----------
+    log_weights: array of n_worlds floats
+        Log-weights of the worlds, given the conditions and factors so far
+        (-inf for worlds which are ruled out).
+
+    """
+
+    def __init__(self, n_worlds, rng=None):
+        self.n_worlds = n_worlds
+        self.rng = check_rng(rng)
+        self.scope = MemScope()
+        self.log_weights = np.zeros(n_worlds)
+
+    def flip(self, p=.5):
+        """
+        Bernoulli choices with parameter p (a float, or one per world).
+
+        """
+
+        return self.rng.rand(self.n_worlds) < p
+
+    def multinomial(self, probs):
+        """
+        Categorical choices with class weights probs.
+
+        """
+
+        cs = np.cumsum(probs, dtype=float)  # CDF
+        cs /= cs[-1]  # normalization for stochasticity
+        return np.searchsorted(cs, self.rng.rand(self.n_worlds))
+
+    def mem(self, func, maxsize=None):
+        """
+        Memoizes a random function of these worlds (see `mem`): func
+        returns one value per world, drawn once for each argument.
+
+        """
+
+        return self.scope.mem(func, maxsize=maxsize)
+
+    def condition(self, holds):
+        """
+        Rules out the worlds in which a condition doesn't hold (rejection).
+
+        """
+
+        self.log_weights[~np.asarray(holds, dtype=bool)] = -np.inf
+
+    def factor(self, log_likelihood):
+        """
+        Weights the worlds with the likelihood of some evidence (likelihood
+        weighting), e.g an observation with a noisy outcome.
+
+        """
+
+        self.log_weights += log_likelihood
+
+
+def query(model, n_worlds=10000, batch_size=10000, rng=None):
+    """
+    Posterior expectation of the value of a probabilistic program, by
+    rejection sampling and likelihood weighting, over batches of worlds run
+    at once (see `Worlds`).
+
+    Parameters
+    ----------
+    model: callable
+        Maps a `Worlds` object to the value of the query in each world (an
+        array with n_worlds entries along its first axis, e.g booleans for
+        the probability of an event), after conditioning on the evidence
+        with `Worlds.condition` or `Worlds.factor`.
+
+    n_worlds: int, optional (default 10000)
+        Number of worlds to run.
+
+    batch_size: int, optional (default 10000)
+        Number of worlds run at once.
+
+    rng: RandomState or seed, optional (default None)
+        Source of the random choices (see `check_rng`).
+
+    Returns
+    -------
+    estimate: float or array
+        Weighted mean of the values (nan if the evidence ruled out all the
+        worlds).
+
+    n_eff: float
+        Effective number of worlds behind the estimate, (sum w)^2 / sum w^2
+        (the number of accepted worlds, under pure rejection).
+
+    """
+
+    rng = check_rng(rng)
+    values, log_weights = [], []
+    for start in xrange(0, n_worlds, batch_size):
+        worlds = Worlds(min(batch_size, n_worlds - start), rng=rng)
+        values.append(np.asarray(model(worlds), dtype=float))
+        log_weights.append(worlds.log_weights)
+    values, log_weights = np.concatenate(values), np.concatenate(log_weights)
+    if np.isneginf(log_weights).all():
+        return np.nan * np.ones(values.shape[1:]), 0.
+    weights = np.exp(log_weights - log_weights.max())
+    keep = weights > 0  # ruled out worlds may have nan values
+    weights, values = weights[keep], values[keep]
+    estimate = np.tensordot(weights, values, axes=1) / weights.sum()
+    return estimate, weights.sum() ** 2 / (weights ** 2).sum()
+
+
+def _bandwidth(matrix):
+    # bandwidth of a symmetric sparse matrix, after reverse Cuthill-McKee
+    # reordering of its rows and columns
+    matrix = sp.csr_matrix(matrix)
+    rank = np.argsort(reverse_cuthill_mckee(matrix, symmetric_mode=True))
+    coo = matrix.tocoo()
+    return np.abs(rank[coo.row] - rank[coo.col]).max() if coo.nnz else 0
 
 
 class MarkovChain(object):
     """
     Finite-state discrete-time Markov chain.
 
+    The transition table can be a dense array, or a scipy.sparse matrix
+    (stored in CSR format), for chains with many states; the analysis
+    methods (`stationary_distribution`, `spectral_gap`,
+    `mixing_time_bounds`, `k_step`) then use sparse solvers.
+
+    The CDFs of the rows are computed once, at construction: drawing next
+    states (`draw`, or `draw_many` for many chains at once) costs a binary
+    search, over the nonzero transitions only when the table is sparse.
+
+    Draws (and a random transition table, if n_states is given instead of
+    trans_table) come from `rng`, a RandomState or a seed (see
+    `check_rng`); the default is numpy's global RandomState.
+
     """
 
-    def __init__(self, trans_table=None, n_states=None, memory=Memory(None)):
-        self.memory = memory
+    def __init__(self, trans_table=None, n_states=None, rng=None):
         self.trans_table = trans_table
         self.n_states = n_states
+        self.rng = rng
+        self.rng_ = check_rng(rng)
         if trans_table is None:
             assert not n_states is None, (
                 "Exactly on of trans_table and n_states should be specified!")
             self.n_states_ = n_states
-            self.trans_table_ = self.memory.cache(np.random.rand)(n_states, n_states)
+            self.trans_table_ = self.rng_.rand(n_states, n_states)
 
             # normalization for stochasticity
-            self.trans_table_ /= self.trans_table_.sum(axis=1)
+            self.trans_table_ /= self.trans_table_.sum(axis=1)[:, np.newaxis]
         else:
             assert n_states is None, (
                 "Exactly on of trans_table and n_states should be specified!")
-            self.trans_table_ = np.array(self.trans_table)
+            if sp.issparse(self.trans_table):
+                self.trans_table_ = sp.csr_matrix(self.trans_table,
+                                                  dtype=float, copy=True)
+                self.trans_table_.eliminate_zeros()
+            else: self.trans_table_ = np.array(self.trans_table)
             n, m = self.trans_table_.shape
             assert n == m
             self.n_states_ = m
 
-    def _check_none(self, x): return 0 if x is None else x
-
-    def draw(self, x): return multinomial(self.trans_table_[
-            self._check_none(x)])
-
-    def trans(self, x, y): return self.trans_table_[self._check_none(x),
-                                                    self._check_none(y)]
+        if sp.issparse(self.trans_table_):
+            self.indptr_ = self.trans_table_.indptr
+            probs = self.trans_table_.data
+        else:
+            self.indptr_ = np.arange(self.n_states_ + 1) * self.n_states_
+            probs = self.trans_table_.ravel()
+        self.cdfs_ = _row_cdfs(probs, self.indptr_)
 
+    def _check_none(self, x): return 0 if x is None else x
 
-def metropolis_hastings(p, q, n_samples, x0=None, maxit=1000, lag=100):
+    def draw(self, x): return int(self.draw_many(self._check_none(x)))
+
+    def draw_many(self, states, u=None):
+        """
+        Next states of many chains at once.
+
+        Parameters
+        ----------
+        states: array of integers
+            Current states of the chains.
+
+        u: array of floats in [0, 1), optional (default None)
+            Uniforms driving the draws, one per chain (drawn from the
+            chain's rng if None).
+
+        Returns
+        -------
+        next_states: array of integers, of the shape of `states`
+
+        """
+
+        states = np.asarray(states)
+        if u is None: u = self.rng_.rand(*states.shape)
+        slots = _draw_rows(self.cdfs_, self.indptr_, states, u)
+        if sp.issparse(self.trans_table_):
+            return self.trans_table_.indices[slots]
+        return slots - self.indptr_[states]
+
+    def trans(self, x, y):
+        x, y = self._check_none(x), self._check_none(y)
+        if sp.issparse(self.trans_table_) and (np.ndim(x) or np.ndim(y)):
+            # elementwise lookup, not a submatrix
+            return np.asarray(self.trans_table_[x, y]).reshape(
+                np.broadcast(x, y).shape)
+        return self.trans_table_[x, y]
+
+    def _eigs(self, matrix, k, which, maxiter=None, tol=0):
+        # k eigenvalues / eigenvectors of a (transposed) transition table,
+        # with ARPACK if it's sparse and big enough, with LAPACK otherwise
+        if sp.issparse(matrix) and self.n_states_ > k + 1:
+            return spla.eigs(matrix, k=k, which=which, maxiter=maxiter,
+                             tol=tol)
+        if sp.issparse(matrix): matrix = matrix.toarray()
+        vals, vecs = np.linalg.eig(matrix)
+        order = np.argsort(-vals.real if which == "LR" else -np.abs(vals))
+        return vals[order[:k]], vecs[:, order[:k]]
+
+    def stationary_distribution(self, method="auto", tol=1e-10,
+                                maxiter=100000):
+        """
+        Stationary distribution pi = pi P of the chain (unique if it's
+        irreducible).
+
+        Parameters
+        ----------
+        method: string, optional (default "auto")
+            "eigs" to compute the eigenvector of P^T for eigenvalue 1
+            (ARPACK for sparse tables), "power" for power iteration on the
+            lazy chain (I + P) / 2 (which has the same stationary
+            distribution, and is aperiodic), "solve" to solve (P^T - I) pi =
+            0 (with the last entry of pi pinned) by sparse LU.
+
+            The first two converge fast on fast mixing chains, but not on
+            slowly mixing ones (e.g random walks on long cycles or grids),
+            for which "solve" is the method of choice (its LU factors stay
+            sparse for such local chains, but fill in on expander-like
+            ones). "auto" tries "eigs" (for at most 100 iterations), then
+            "solve".
+
+        tol: float, optional (default 1e-10)
+            Tolerance (on the l1 change of pi, for power iteration).
+
+        maxiter: int, optional (default 100000)
+            Maximum number of power iterations.
+
+        """
+
+        trans = self.trans_table_.T
+        if method == "auto":
+            try: pi = self._eigs(trans, 1, "LR", maxiter=100)[1][:, 0].real
+            except spla.ArpackNoConvergence: method = "solve"
+        if method == "power":
+            pi = np.ones(self.n_states_) / self.n_states_
+            for _ in xrange(maxiter):
+                pi_ = .5 * (pi + trans.dot(pi))
+                delta = np.abs(pi_ - pi).sum()
+                pi = pi_
+                if delta < tol: break
+        elif method == "solve":
+            A = sp.csc_matrix(trans) - sp.identity(self.n_states_,
+                                                   format="csc")
+            pi = np.ones(self.n_states_)
+            pi[:-1] = spla.spsolve(A[:-1, :-1], -A[:-1, -1].toarray().ravel())
+        elif method == "eigs":
+            pi = self._eigs(trans, 1, "LR")[1][:, 0].real
+        else: assert method == "auto", "unknown method: %s" % method
+
+        # fix the sign, and round-off
+        pi = np.maximum(pi * np.sign(pi.sum()), 0.)
+        self.stationary_ = pi / pi.sum()
+        return self.stationary_
+
+    def _stationary(self):
+        # stationary distribution, computed once
+        pi = getattr(self, "stationary_", None)
+        return self.stationary_distribution() if pi is None else pi
+
+    def _symmetrized(self):
+        # D^1/2 P D^-1/2 (D = diag(pi)), a symmetric CSC matrix with the
+        # spectrum of P, if the chain is reversible (i.e D P is symmetric)
+        # and pi > 0; None otherwise
+        pi = self._stationary()
+        if pi.min() <= 0: return None
+        flows = sp.diags(pi).dot(self.trans_table_)
+        if abs(flows - flows.T).max() > 1e-8 * abs(flows).max(): return None
+        sym = sp.diags(np.sqrt(pi)).dot(self.trans_table_).dot(
+            sp.diags(1. / np.sqrt(pi)))
+        return ((sym + sym.T) / 2.).tocsc()
+
+    def _slow_eigenvalues(self, sym, tol, maxiter):
+        # lambda_2, and the smallest eigenvalue, of a slowly mixing reversible
+        # chain, by shift-invert at 1 and -1 (see `spectral_gap`)
+        n = self.n_states_
+        d = np.sqrt(self.stationary_)  # eigenvector of sym for eigenvalue 1
+        identity = sp.identity(n, format="csc")
+
+        # sym deflated of d, at 1: sym - I is singular (its kernel is d), so
+        # it's solved with the last entry pinned, and projected out of d
+        try: lu = spla.splu((sym - identity)[:-1, :-1].tocsc())
+        except RuntimeError: return 1., 1.  # exactly singular: reducible
+
+        def solve(b):
+            b = np.ravel(b)
+            c = d.dot(b)
+            x = np.zeros(n)
+            x[:-1] = lu.solve(b[:-1] - c * d[:-1])
+            return x - (d.dot(x) + c) * d
+
+        deflated = spla.LinearOperator(
+            (n, n), matvec=lambda x: sym.dot(np.ravel(x)) - d.dot(
+                np.ravel(x)) * d, dtype=float)
+        lambda_2 = spla.eigsh(deflated, k=1, sigma=1., tol=tol,
+                              maxiter=maxiter, OPinv=spla.LinearOperator(
+                (n, n), matvec=solve, dtype=float),
+                              return_eigenvectors=False)[0]
+
+        # smallest eigenvalue, unless it's ruled out by Gershgorin's theorem
+        # (e.g for lazy chains, whose eigenvalues are all >= 0)
+        lambda_min = 2. * self.trans_table_.diagonal().min() - 1.
+        if lambda_min < -lambda_2:
+            try: lu = spla.splu((sym + identity).tocsc())
+            except RuntimeError: return 1., -1.  # exactly singular: periodic
+            lambda_min = spla.eigsh(
+                sym, k=1, sigma=-1., tol=tol, maxiter=maxiter,
+                OPinv=spla.LinearOperator((n, n), matvec=lu.solve,
+                                          dtype=float),
+                return_eigenvectors=False)[0]
+        return 1., max(lambda_2, -lambda_min)
+
+    def spectral_gap(self, tol=1e-8, maxiter=100, max_fill=5 * 10 ** 7):
+        """
+        Absolute spectral gap 1 - |lambda_2| of the transition table, where
+        lambda_2 is its second eigenvalue of largest modulus; its inverse is
+        the relaxation time of the chain. Zero for periodic or reducible
+        chains. The result is also stored in `spectral_gap_`.
+
+        For sparse tables, the two eigenvalues of largest modulus are found
+        by ARPACK, with relative tolerance `tol`, in at most `maxiter`
+        iterations; on the symmetrized table D^1/2 P D^-1/2 (D = diag(pi))
+        if the chain is reversible. On slowly mixing chains (e.g random
+        walks on long cycles or grids), lambda_2 can't be told apart from 1
+        in so many iterations: if the chain is reversible, lambda_2 is then
+        found by shift-invert at 1 of the table deflated of pi (and the
+        smallest eigenvalue, if need be, by shift-invert at -1), with sparse
+        LU factors, which stay sparse on such local chains. Otherwise, or if
+        the LU factors could have more than `max_fill` entries (as bounded
+        by the bandwidth of the table after reverse Cuthill-McKee
+        reordering, e.g on random graphs), ARPACK's
+        scipy.sparse.linalg.ArpackNoConvergence is raised.
+
+        """
+
+        trans = self.trans_table_
+        sym = None
+        if sp.issparse(trans) and self.n_states_ > 3:
+            sym = self._symmetrized()
+        if sym is None:
+            vals = self._eigs(trans, 2, "LM", maxiter=maxiter, tol=tol)[0]
+        else:
+            try: vals = spla.eigsh(sym, k=2, tol=tol, maxiter=maxiter,
+                                   return_eigenvectors=False)
+            except spla.ArpackNoConvergence:
+                # LU factors fill in at most n x the bandwidth of sym
+                if self.n_states_ * _bandwidth(sym) > max_fill: raise
+                vals = self._slow_eigenvalues(sym, tol, maxiter)
+        self.spectral_gap_ = max(0., 1. - np.sort(np.abs(vals))[0])
+        return self.spectral_gap_
+
+    def mixing_time_bounds(self, eps=.25):
+        """
+        Bounds on the mixing time t_mix(eps) (number of steps after which
+        the distribution of the chain is eps-close to stationarity, in total
+        variation) from the relaxation time t_rel = 1 / spectral gap:
+
+            (t_rel - 1) log(1 / (2 eps)) <= t_mix(eps)
+                                         <= t_rel log(1 / (eps pi_min)).
+
+        These hold for reversible chains (Levin, Peres and Wilmer, "Markov
+        Chains and Mixing Times", Thms 12.4 and 12.5), and are only
+        indicative otherwise. Use them to choose the `lag` of samplers.
+
+        The spectral gap and the stationary distribution are only computed
+        (with the default parameters) if they aren't already, see
+        `spectral_gap_` and `stationary_`.
+
+        Returns
+        -------
+        lower, upper: floats
+            The bounds (inf if the spectral gap is zero).
+
+        """
+
+        gap = getattr(self, "spectral_gap_", None)
+        if gap is None: gap = self.spectral_gap()
+        pi = self._stationary()
+        t_rel = 1. / gap if gap > 0 else np.inf
+        with np.errstate(divide="ignore"):
+            upper = t_rel * np.log(1. / (eps * pi.min()))
+        return (t_rel - 1.) * np.log(1. / (2. * eps)), upper
+
+    def k_step(self, k):
+        """
+        k-step transition table P^k, by repeated squaring (O(log k) matrix
+        products; sparse tables stay sparse, but fill in as k grows).
+
+        """
+
+        trans = self.trans_table_
+        power = sp.identity(self.n_states_, format="csr") if sp.issparse(
+            trans) else np.eye(self.n_states_)
+        while k:
+            if k & 1: power = power.dot(trans)
+            k >>= 1
+            if k: trans = trans.dot(trans)
+        return power
+
+
+def metropolis_hastings(p, q, n_samples, x0=None, maxit=1000, lag=100,
+                        rng=None):
     """
     Metropolis-Hastings (rejection) sampler.
 
@@ -99,6 +732,10 @@ def metropolis_hastings(p, q, n_samples, x0=None, maxit=1000, lag=100):
     lag: int, optional (default 100)
        the first `lag` draws will be rejected (so that the engine warms up)
 
+    rng: RandomState or seed, optional (default None)
+       source of the acceptance tests (see `check_rng`); q draws its
+       proposals from its own rng
+
     Returns
     -------
     generator object: for generating n_samples points from the distribution p, using
@@ -111,13 +748,95 @@ def metropolis_hastings(p, q, n_samples, x0=None, maxit=1000, lag=100):
     """
 
     x = x0
+    rng = check_rng(rng)
     maxit = max(maxit, n_samples + lag)  # maxit should be large enough
     for i in xrange(maxit):
         # draw y from q(.|x)
         y = q.draw(x)
 
         # keep y with probablity min(p(y)*q.trans(x,y)/(p(x)*q.trans(y,x)),1.)
-        if flip(min(p(y) * q.trans(y, x) / (p(x)  * q.trans(x, y)), 1.)): x = y
+        if flip(min(p(y) * q.trans(y, x) / (p(x)  * q.trans(x, y)), 1.),
+                rng=rng): x = y
 
         # yield sample point if in tail of runs
         if i >= maxit - n_samples: yield x
+
+
+def batch_metropolis_hastings(p, q, n_samples, n_chains=1, x0=None, lag=100,
+                              thin=1, log=False, block=1024, rng=None):
+    """
+    Metropolis-Hastings sampler, running many independent chains at once.
+
+    The proposals y ~ q(.|x) of all the chains are drawn together (with
+    `MarkovChain.draw_many`, so that q's transition table may be sparse),
+    and accepted together, with probability min(1, p(y) q(x|y) / (p(x)
+    q(y|x))) computed on log-probabilities.
+
+    Parameters
+    ----------
+    p: 1D array-like, or callable
+        (Unnormalized) probability masses of the states, or a callable which
+        maps an array of states to their masses. Log-masses if `log` is set.
+
+    q: `MarkovChain`
+        The proposal chain.
+
+    n_samples: int
+        number of samples to draw, per chain
+
+    n_chains: int, optional (default 1)
+        number of independent chains
+
+    x0: int or array of n_chains integers, optional (default None)
+        starting states; drawn uniformly at random if None
+
+    lag: int, optional (default 100)
+       the first `lag` draws will be rejected (so that the engine warms up)
+
+    thin: int, optional (default 1)
+       only every `thin`-th draw (after the first `lag`) is kept
+
+    block: int, optional (default 1024)
+       number of steps whose random numbers are drawn at once
+
+    rng: RandomState or seed, optional (default None)
+       source of all the random numbers (see `check_rng`), proposals
+       included; runs with the same seed give the same samples
+
+    Returns
+    -------
+    samples: 2D array of integers, of shape (n_chains, n_samples)
+        samples[c] are the samples of chain c.
+
+    """
+
+    n = q.n_states_
+    log_rows = np.log(np.asarray(q.trans_table_.sum(axis=1),
+                                 dtype=float).ravel())
+    log_q = lambda x, y: np.log(q.trans(x, y)) - log_rows[x]
+    with np.errstate(divide="ignore"):
+        if callable(p): log_p = p if log else lambda x: np.log(p(x))
+        else:
+            table = np.asarray(p, dtype=float)
+            if not log: table = np.log(table)
+            log_p = lambda x: table[x]
+
+    rng = check_rng(rng)
+    x = rng.randint(n, size=n_chains) if x0 is None else (
+        np.zeros(n_chains, dtype=int) + x0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        lp = log_p(x)
+    samples = np.empty((n_chains, n_samples), dtype=int)
+    n_steps = lag + n_samples * thin
+    for start in xrange(0, n_steps, block):
+        u = rng.rand(min(block, n_steps - start), 2, n_chains)
+        for i, (u_prop, u_acc) in enumerate(u, start):
+            y = q.draw_many(x, u_prop)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                ly = log_p(y)
+                accept = np.log(u_acc) < ly - lp + log_q(y, x) - log_q(x, y)
+            x = np.where(accept, y, x)
+            lp = np.where(accept, ly, lp)
+            if i >= lag and (i - lag + 1) % thin == 0:
+                samples[:, (i - lag) // thin] = x
+    return samples
@@ -0,0 +1,149 @@
+"""
+:Synopsis: Elementary cellular automata (all 256 Wolfram rules), vectorized.
+:Author: DOHMATOB Elvis Dopgima <gmdopp@gmail.com> <elvis.dohmatob@inria.fr>
+
+A row of cells evolves on the circle: the next state of cell j is bit
+4 l + 2 c + r of the rule number, where l, c, r are the states of cells
+j - 1, j, j + 1. Many independent rows evolve at once, and space-time
+diagrams are written straight into a (preallocated, possibly memory-mapped)
+uint8 array.
+
+"""
+
+import numpy as np
+
+LIVE_CHR = "#"
+DEAD_CHR = " "
+
+
+def rule_table(rule):
+    """
+    Lookup table of a Wolfram rule: entry 4 l + 2 c + r is the next state
+    of a cell with neighbourhood (l, c, r).
+
+    """
+
+    assert 0 <= rule < 256, "rule must be in [0, 255], got %s" % rule
+    return ((rule >> np.arange(8)) & 1).astype(np.uint8)
+
+
+def _neighbourhoods(rows, out):
+    # out = 4 l + 2 c + r, with periodic boundaries
+    np.multiply(rows, 2, out=out)
+    out[..., 1:] += rows[..., :-1] << 2
+    out[..., :1] += rows[..., -1:] << 2
+    out[..., :-1] += rows[..., 1:]
+    out[..., -1:] += rows[..., :1]
+    return out
+
+
+def step(rows, rule, out=None):
+    """
+    Next generation of rows of cells.
+
+    Parameters
+    ----------
+    rows: array of 0/1 uint8, of shape (..., n)
+        Independent rows of n cells each.
+
+    rule: int or array
+        Wolfram rule number, or its `rule_table`.
+
+    out: array of uint8, optional (default None)
+        Where to write the next generation (not `rows` itself).
+
+    """
+
+    table = rule_table(rule) if np.isscalar(rule) else rule
+    rows = np.asarray(rows, dtype=np.uint8)
+    idx = _neighbourhoods(rows, np.empty_like(rows))
+    return np.take(table, idx, out=out)
+
+
+def evolve(init, rule, n_gens, out=None):
+    """
+    Space-time diagram of rows of cells.
+
+    Parameters
+    ----------
+    init: array of 0/1, of shape (n,) or (n_rows, n)
+        Initial generation (one or many independent rows).
+
+    rule: int
+        Wolfram rule number.
+
+    n_gens: int
+        Number of generations to compute.
+
+    out: array of uint8, of shape (n_gens + 1,) + init.shape, optional
+        Where to write the diagram; e.g a preallocated array, or a
+        memory-map (`np.memmap`, `np.lib.format.open_memmap`).
+
+    Returns
+    -------
+    out: array of uint8, of shape (n_gens + 1,) + init.shape
+        Generation t is out[t].
+
+    """
+
+    init = np.asarray(init)
+    shape = (n_gens + 1,) + init.shape
+    if out is None: out = np.empty(shape, dtype=np.uint8)
+    assert out.shape == shape and out.dtype == np.uint8, (
+        "out must be a uint8 array of shape %s" % (shape,))
+    table = rule_table(rule)
+    idx = np.empty(init.shape, dtype=np.uint8)
+    out[0] = init != 0
+    for t in xrange(n_gens):
+        np.take(table, _neighbourhoods(out[t], idx), out=out[t + 1])
+    return out
+
+
+def record(init, rule, n_gens, history, chunk_size=1024):
+    """
+    Evolves rows of cells, streaming the generations to a history (see
+    `spacetime.HistoryWriter`) chunk by chunk, through a reused buffer.
+
+    Parameters
+    ----------
+    init, rule, n_gens:
+        As in `evolve`.
+
+    history: `spacetime.HistoryWriter`
+        Where the generations (init included) are appended. The run stops
+        early if it detects a cycle.
+
+    Returns
+    -------
+    n_gens: int
+        Number of generations actually computed.
+
+    """
+
+    init = np.asarray(init)
+    buf = np.empty((chunk_size + 1,) + init.shape, dtype=np.uint8)
+    buf[0] = init != 0
+    if history.append(buf[0]): return 0
+    done = 0
+    while done < n_gens:
+        n = min(chunk_size, n_gens - done)
+        evolve(buf[0], rule, n, out=buf[:n + 1])
+        for t in xrange(1, n + 1):
+            if history.append(buf[t]): return done + t
+        done += n
+        buf[0] = buf[n]
+    return done
+
+
+def render(diagram):
+    """
+    Text rendering of a space-time diagram of one row (one line per
+    generation), built at once.
+
+    """
+
+    n_gens, n = diagram.shape
+    chars = np.empty((n_gens, n + 1), dtype=np.uint8)
+    chars[:, :n] = np.where(diagram, ord(LIVE_CHR), ord(DEAD_CHR))
+    chars[:, n] = ord("\n")
+    return chars.tobytes()
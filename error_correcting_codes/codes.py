@@ -3,13 +3,23 @@
 
 """
 
-import itertools
+import os
+import sys
 import numpy as np
-import networkx as nx
+import scipy.sparse as sp
 import pylab as pl
+from gf2 import css_code_parameters
+import quasi_cyclic
+
+# random streams are normalized by `core.check_rng`, shared with the rest of
+# the repository (the parent directory)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+from core import check_rng
 
 # number of variable nodes in Tanner graph
-_tanner_nvar_nodes = lambda checks: len(set.union(*map(set, checks)))
+_tanner_nvar_nodes = lambda checks: len(np.unique(np.concatenate(
+            [np.asarray(check, dtype=int) for check in checks])))
 
 
 def rotate_list (l, r=1):
@@ -22,14 +32,92 @@ def rotate_list (l, r=1):
     return l[-r:] + l[:-r]
 
 
+def parmat2checks(h):
+    """
+    Supports of the rows of a parity-check matrix (dense or scipy.sparse).
+
+    """
+
+    h = sp.csr_matrix(h, copy=True)
+    h.eliminate_zeros()
+    h.sort_indices()
+    return np.split(h.indices, h.indptr[1:-1])
+
+
+def is_parmat(checks, codelength=None):
+    """
+    Whether a code given as `checks` is a parity-check matrix, rather than
+    the supports of the rows of one. scipy.sparse matrices are; a dense 2D
+    array is if its entries are 0s and 1s and it has `codelength` columns
+    (when given). Supports are 2D arrays too when the checks have the same
+    degree, e.g np.array([[0, 1, 2, 4], [1, 2, 3, 5], [0, 2, 3, 6]]).
+
+    """
+
+    if sp.issparse(checks): return True
+    if not (isinstance(checks, np.ndarray) and checks.ndim == 2): return False
+    if codelength is not None and checks.shape[1] != codelength: return False
+    return bool(np.all((checks == 0) | (checks == 1)))
+
+
+def tanner_adjacency(checks=None, nvars=None, parmat=None):
+    """
+    Compact (CSR) adjacency structure of a Tanner graph.
+
+    The edges are numbered check-by-check; check c has edges
+    check_ptr[c]:check_ptr[c + 1], going to the variable nodes check_vars[e].
+    Variable node v has edges var_edges[var_ptr[v]:var_ptr[v + 1]], going to
+    the check nodes of these edges.
+
+    Parameters
+    ----------
+    checks: list of lists (or 2D array) of integers, or sparse matrix
+        The Tanner graph, given by the supports of the rows of its
+        parity-check matrix, or by the matrix itself if it's sparse.
+
+    nvars: int, optional (default None)
+        Number of variable nodes. Inferred from checks if None.
+
+    parmat: 2D array or sparse matrix, optional (default None)
+        The parity-check matrix, given instead of checks (a dense 2D array
+        passed as checks is read as supports).
+
+    Returns
+    -------
+    check_ptr, check_vars, var_ptr, var_edges: arrays of integers
+
+    """
+
+    if parmat is None and sp.issparse(checks): parmat = checks
+    if parmat is not None:
+        h = sp.csr_matrix(parmat, copy=True)
+        h.eliminate_zeros()
+        h.sort_indices()
+        nvars = h.shape[1]
+        check_ptr, check_vars = h.indptr.astype(int), h.indices.astype(int)
+    else:
+        if nvars is None: nvars = _tanner_nvar_nodes(checks)
+        degrees = [len(check) for check in checks]
+        check_ptr = np.append(0, np.cumsum(degrees)).astype(int)
+        check_vars = np.concatenate(
+            [np.asarray(check, dtype=int) for check in checks] + [
+                np.zeros(0, dtype=int)])
+
+    var_edges = np.argsort(check_vars, kind="mergesort")
+    var_ptr = np.append(0, np.cumsum(np.bincount(check_vars,
+                                                 minlength=nvars)))
+    return check_ptr, check_vars, var_ptr, var_edges
+
+
 def parmat2graph(h):
+    import networkx as nx
     nchecks, nvars = h.shape
-    checks =[r.nonzero()[0] for r in h]
+    check_ptr, check_vars, _, _ = tanner_adjacency(parmat=h)
     graph = nx.Graph()
     graph.add_nodes_from(xrange(nvars), bipartite=0)
     graph.add_nodes_from(xrange(nvars, nvars + nchecks), bipartite=1)
-    for cn, check in enumerate(checks):
-        for vn in check: graph.add_edge(cn + nvars, vn)
+    graph.add_edges_from(zip(np.repeat(np.arange(nchecks), np.diff(
+                    check_ptr)) + nvars, check_vars))
 
     return graph, xrange(nvars), xrange(nvars, nvars + nchecks)
 
@@ -45,6 +133,7 @@ def _tanner_iter_edges(checks):
 
 
 def tanner_graph(checks):
+    import networkx as nx
     G = nx.Graph()
     G.add_edges_from(_tanner_iter_edges(checks))
     return G
@@ -54,7 +143,22 @@ def tanner_cycle(n):
     return [[j, (j + 1) % n] for j in xrange(n)]
 
 
-def tanner_cartesian_product(checks1, checks2, split=False):
+def checks2parmat(checks, nvars=None):
+    """
+    Parity-check matrix (in CSR format) with rows supported on checks.
+
+    """
+
+    if nvars is None: nvars = _tanner_nvar_nodes(checks)
+    degrees = [len(check) for check in checks]
+    indices = np.concatenate([np.asarray(check, dtype=int)
+                              for check in checks]) if checks else []
+    return sp.csr_matrix((np.ones(np.sum(degrees), dtype=int), indices,
+                          np.append(0, np.cumsum(degrees))),
+                         shape=(len(checks), nvars))
+
+
+def tanner_cartesian_product(checks1, checks2, split=False, parmat=False):
     """
     Cartesian product G1 x G2 of two Tanner graphs Gi = (Vi, Ci, Ei),
     i = 1, 2, where for each of the lists checksi has been defined
@@ -66,99 +170,123 @@ def tanner_cartesian_product(checks1, checks2, split=False):
 
         chrom(G1 x G2) = max(chrom(G1), chrom(G2)) = 2.
 
+    The nodes of G1 x G2 are numbered in closed form: variable nodes are
+    (v1, v2) -> v1 * |V2| + v2, followed by (c1, c2) -> |V1||V2| + c1 * |C2| +
+    c2; X checks are (v1, c2) -> v1 * |C2| + c2 and Z checks are
+    (c1, v2) -> c1 * |V2| + v2. With H1 and H2 the parity-check matrices of
+    G1 and G2, this is the hypergraph product
+
+        HX = [I x H2, H1^T x I],  HZ = [H1 x I, I x H2^T],
+
+    which is assembled with sparse kron products in time linear in its
+    number of edges.
+
+    Parameters
+    ----------
+    split: bool, optional (default False)
+        If set, the X and Z checks are returned separately.
+
+    parmat: bool, optional (default False)
+        If set, parity-check matrices (in CSR format) are returned instead of
+        lists of checks.
+
     Returns
     -------
     checks: list of lists
         compact representation for the cyclic code represented by the Tanner
-        graph G1 x G2.
-
-    """
-
-    nvars1, nvars2 = _tanner_nvar_nodes(checks1), _tanner_nvar_nodes(checks2)
-    nchecks1, nchecks2 = len(checks1), len(checks2)
-    var_nodes1, var_nodes2 = xrange(nvars1), xrange(nvars2)
-    check_nodes1 = xrange(nvars1, nvars1 + nchecks1)
-    check_nodes2 = xrange(nvars2, nvars2 + nchecks2)
-    var_nodes = list(set(itertools.product(var_nodes1, var_nodes2)).union(
-            itertools.product(check_nodes1, check_nodes2)))
-    if split:
-        iX, iZ = [], []
-        check_nodesX = list(itertools.product(check_nodes1, var_nodes2))
-        check_nodesZ = list(itertools.product(var_nodes1, check_nodes2))
-        check_nodes = list(set(check_nodesX).union(check_nodesZ))
-    else:
-        check_nodes = list(set(itertools.product(
-                    check_nodes1, var_nodes2)).union(
-                itertools.product(var_nodes1, check_nodes2)))
-    checks = [[] for _ in xrange(len(check_nodes))]
-    for (x, y), z in itertools.product(_tanner_iter_edges(checks1),
-                                       _tanner_iter_nodes(checks2)):
-        if (x, z) in check_nodes:
-            cn, vn = check_nodes.index((x, z)), var_nodes.index((y, z))
-            if split and not (cn in iX or cn in iZ): iX.append(cn)
-        else:
-            cn, vn = check_nodes.index((y, z)), var_nodes.index((x, z))
-            if split and not (cn in iX or cn in iZ): iZ.append(cn)
-        checks[cn].append(vn)
-    for x, (y, z) in itertools.product(_tanner_iter_nodes(checks1),
-                                       _tanner_iter_edges(checks2)):
-        if (x, y) in check_nodes:
-            cn, vn = check_nodes.index((x, y)), var_nodes.index((x, z))
-            if split and not (cn in iX or cn in iZ): iX.append(cn)
-        else:
-            cn, vn = check_nodes.index((x, z)), var_nodes.index((x, y))
-            if split and not (cn in iZ or cn in iX): iZ.append(cn)
-        checks[cn].append(vn)
-
-    return ([checks[i] for i in iX], [checks[i] for i in iZ]
-            ) if split else checks
-
-
-def tanner_cartesian_power(checks, n, split=False):
+        graph G1 x G2 (or the pair (checksX, checksZ), if `split` is set).
+
+    """
+
+    H1, H2 = checks2parmat(checks1), checks2parmat(checks2)
+    (nchecks1, nvars1), (nchecks2, nvars2) = H1.shape, H2.shape
+    HX = sp.hstack((sp.kron(sp.identity(nvars1, dtype=int), H2),
+                    sp.kron(H1.T, sp.identity(nchecks2, dtype=int))),
+                   format="csr")
+    HZ = sp.hstack((sp.kron(H1, sp.identity(nvars2, dtype=int)),
+                    sp.kron(sp.identity(nchecks1, dtype=int), H2.T)),
+                   format="csr")
+    if not split: HX, HZ = sp.vstack((HX, HZ), format="csr"), None
+    if not parmat:
+        HX = [list(check) for check in parmat2checks(HX)]
+        if split: HZ = [list(check) for check in parmat2checks(HZ)]
+
+    return (HX, HZ) if split else HX
+
+
+def tanner_cartesian_power(checks, n, split=False, parmat=False):
     """
     Cartesian power of Tanner graph G. Note that G^n is again a Tanner graph.
 
     Returns
     -------
-    Compact representation checks_, for G^n.
+    Compact representation checks_, for G^n (or its parity-check
+    matrix, if `parmat` is set).
 
     """
 
     checks_ = checks
     for _ in xrange(n - 2):
         checks_ = tanner_cartesian_product(checks_, checks)
-    return tanner_cartesian_product(checks_, checks, split=split)
+    return tanner_cartesian_product(checks_, checks, split=split,
+                                    parmat=parmat)
 
 
-def css_code(GX, GZ):
+def css_code(GX, GZ, dense=False):
     """
     CSS code construction.
 
+    GX and GZ can be dense arrays or scipy.sparse matrices. The parity-check
+    matrix is returned in CSR format, unless `dense` is set, or GX and GZ
+    are both quasi-cyclic (then so is it).
+
     """
 
-    # XXX use scipy.linalg sparse constructs (csr_matrix, etc.) !!!
-    return np.vstack((np.hstack((GX, np.zeros((GX.shape[0], GZ.shape[1])))),
-                      np.hstack((np.zeros((GZ.shape[0], GX.shape[1])), GZ))))
+    if all(isinstance(G, quasi_cyclic.QuasiCyclic) for G in (GX, GZ)):
+        H = quasi_cyclic.block_diag((GX, GZ))
+    else: H = sp.block_diag((GX, GZ), format="csr")
+    return H.toarray() if dense else H
 
 
-def kovalev_code(H1, H2):
+def kovalev_code(H1, H2, dense=False, split=False):
     """
     Kovalev et al's kron product construction.
 
-    """
-
-    r1, n1 = H1.shape
-    r2, n2 = H2.shape
-    E1 = np.eye(r1)
-    E1_ = np.eye(n1)
-    E2 = np.eye(r2)
-    E2_ = np.eye(n2)
+    H1 and H2 can be dense arrays or scipy.sparse matrices. The parity-check
+    matrix is returned in CSR format, unless `dense` is set. If `split` is
+    set, the pair (GX, GZ) of X and Z checks is returned instead (e.g for
+    `gf2.css_code_parameters`).
 
-    return css_code(np.hstack((np.kron(E2, H1), np.kron(H2, E1))),
-                    np.hstack((np.kron(H2.T, E1_), np.kron(E2_, H1.T))))
+    If H1 is quasi-cyclic (see `quasi_cyclic.QuasiCyclic`), the checks are
+    assembled in quasi-cyclic form, with the block size of H1, and are
+    returned as such (unless `dense` is set).
 
+    """
 
-def repetition_code_circulant_matrix(d):
+    if isinstance(H1, quasi_cyclic.QuasiCyclic):
+        (r1, n1), (r2, n2) = H1.shape, H2.shape
+        b = H1.block_size
+        E1, E1_ = quasi_cyclic.identity(r1, b), quasi_cyclic.identity(n1, b)
+        E2, E2_ = sp.identity(r2, dtype=int), sp.identity(n2, dtype=int)
+        kron, hstack = quasi_cyclic.kron, quasi_cyclic.hstack
+    else:
+        H1, H2 = sp.csr_matrix(H1), sp.csr_matrix(H2)
+        r1, n1 = H1.shape
+        r2, n2 = H2.shape
+        E1 = sp.identity(r1, dtype=H1.dtype)
+        E1_ = sp.identity(n1, dtype=H1.dtype)
+        E2 = sp.identity(r2, dtype=H2.dtype)
+        E2_ = sp.identity(n2, dtype=H2.dtype)
+        kron = sp.kron
+        hstack = lambda blocks: sp.hstack(blocks, format="csr")
+
+    GX = hstack((kron(E2, H1), kron(H2, E1)))
+    GZ = hstack((kron(H2.T, E1_), kron(E2_, H1.T)))
+    if split: return (GX.toarray(), GZ.toarray()) if dense else (GX, GZ)
+    return css_code(GX, GZ, dense=dense)
+
+
+def repetition_code_circulant_matrix(d, dense=False, qc=False):
     """
     Returns circulant matrix of repetition code (Hc), where:
 
@@ -166,18 +294,34 @@ def repetition_code_circulant_matrix(d):
         h = (x^n - 1) / g = 1 + x (mod 2)
         Hc = [h, hx, hx^2, ..., hx^(n - 1)]^T
 
+    The matrix is returned in CSR format, unless `dense` is set, or `qc` is
+    set (then it is returned in quasi-cyclic form, i.e as the support {0, 1}
+    of h).
+
     """
 
     assert d >= 2
-    h = np.append([1, 1], np.zeros(d - 2))
-    return np.vstack([rotate_list(h, r=r) for r in xrange(d)])
+    Hc = quasi_cyclic.circulant([0, 1], d)
+    if dense: return Hc.toarray()
+    return Hc if qc else Hc.tocsr()
+
 
+def kovalev_toric_code_construction(d, dense=False, split=False, qc=False):
+    """
+    Toric code from Kovalev et al's construction on the repetition code.
+    The checks are assembled in quasi-cyclic form; they are returned as
+    such if `qc` is set, in CSR format otherwise (or dense, if `dense` is
+    set).
+
+    """
 
-def kovalev_toric_code_construction(d):
-    G = repetition_code_circulant_matrix(d)
-    return kovalev_code(G, G)
+    G = repetition_code_circulant_matrix(d, qc=True)
+    H = kovalev_code(G, G, dense=dense, split=split)
+    if dense or qc: return H
+    return tuple(G.tocsr() for G in H) if split else H.tocsr()
 
 if __name__ == "__main__":
+    import networkx as nx
     pl.close("all")
     d = 7
 
@@ -208,13 +352,14 @@ if __name__ == "__main__":
         nx.draw_graphviz(tj, with_labels=0, node_size=30)
 
     # Kovalev et al's kron constructions
-    title = ("Toric [%i, 2, %i]-code H using Kovalev et al's kron "
-             "product trick") % (2 * d ** 2, d)
+    n, k = css_code_parameters(*kovalev_toric_code_construction(d, split=True))
+    title = ("Toric [%i, %i, %i]-code H using Kovalev et al's kron "
+             "product trick") % (n, k, d)
     toric = kovalev_toric_code_construction(d)
     pl.figure()
     pl.title(title)
     nx.draw_graphviz(parmat2graph(toric)[0], with_labels=False, node_size=30)
-    pl.matshow(toric)
+    pl.matshow(toric.toarray())
     pl.title(title)
     pl.gray()
     pl.axis('off')
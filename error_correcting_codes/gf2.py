@@ -0,0 +1,276 @@
+"""
+:Synopsis: Linear algebra over GF(2), on bit-packed matrices.
+:Author: DOHMATOB Elvis Dopgima <gmdopp@gmail.com> <elvis.dohmatob.inia.fr>
+
+Rows of a binary matrix are packed into arrays of uint64 words: bit j of a
+row lives in bit j % 64 of word j // 64. Row additions are then plain XORs
+of word arrays, i.e 64 columns per machine operation.
+
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+WORD = 64
+_ONE = np.uint64(1)
+
+
+def _nwords(n):
+    return (n + WORD - 1) // WORD
+
+
+def pack(H):
+    """
+    Packs a binary matrix (dense or scipy.sparse) into rows of uint64 words.
+    Entries are taken modulo 2.
+
+    Returns
+    -------
+    packed: 2D array of uint64, of shape (H.shape[0], ceil(H.shape[1] / 64))
+        The packed rows.
+
+    n: int
+        Number of columns of H.
+
+    """
+
+    H = sp.coo_matrix(H)
+    m, n = H.shape
+    odd = (H.data.astype(int) % 2) == 1
+    rows, cols = H.row[odd], H.col[odd]
+    packed = np.zeros((m, _nwords(n)), dtype=np.uint64)
+    np.bitwise_xor.at(packed, (rows, cols // WORD),
+                      _ONE << (cols % WORD).astype(np.uint64))
+    return packed, n
+
+
+def unpack(packed, n):
+    """
+    Inverse of `pack`: returns the dense (uint8) binary matrix.
+
+    """
+
+    packed = np.atleast_2d(packed)
+    bits = (packed[:, :, np.newaxis] >> np.arange(
+            WORD, dtype=np.uint64)) & _ONE
+    return bits.reshape((len(packed), WORD * packed.shape[1]))[:, :n].astype(
+        np.uint8)
+
+
+def _parity(words):
+    """
+    Parity of the number of set bits of each uint64 word.
+
+    """
+
+    words = words.copy()
+    for shift in [32, 16, 8, 4, 2, 1]:
+        words ^= words >> np.uint64(shift)
+    return (words & _ONE).astype(np.uint8)
+
+
+def _column(packed, j):
+    """
+    Column j of a packed matrix, as an array of 0/1 uint64.
+
+    """
+
+    return (packed[:, j // WORD] >> np.uint64(j % WORD)) & _ONE
+
+
+def row_echelon(H, reduced=True):
+    """
+    Gaussian elimination over GF(2), with XORs of packed rows.
+
+    Parameters
+    ----------
+    H: 2D array-like or scipy.sparse matrix, or (packed, n) pair
+        Binary matrix.
+
+    reduced: bool, optional (default True)
+        If set, pivot columns are cleared above the pivots too (reduced row
+        echelon form); otherwise only below.
+
+    Returns
+    -------
+    R: 2D array of uint64
+        Packed row echelon form of H; the first `len(pivots)` rows are
+        non-zero.
+
+    pivots: array of integers
+        Pivot column of each non-zero row of R.
+
+    """
+
+    R, n = H if isinstance(H, tuple) else pack(H)
+    R = R.copy()
+    m = len(R)
+    pivots = []
+    r = 0
+    for j in xrange(n):
+        if r == m: break
+        w = j // WORD
+        col = _column(R, j)
+        candidates = np.nonzero(col[r:])[0]
+        if not len(candidates): continue
+        p = r + candidates[0]
+        if p != r: R[[r, p]] = R[[p, r]]
+        col[[r, p]] = col[[p, r]]
+
+        # clear column j elsewhere; the pivot row is zero before word w
+        if not reduced: col[:r] = 0
+        col[r] = 0
+        others = np.nonzero(col)[0]
+        if len(others): R[others, w:] ^= R[r, w:]
+        pivots.append(j)
+        r += 1
+
+    return R, np.array(pivots, dtype=int)
+
+
+def rank(H):
+    """
+    Rank of binary matrix H over GF(2).
+
+    """
+
+    return len(row_echelon(H, reduced=False)[1])
+
+
+def nullspace(H):
+    """
+    Basis of the (right) kernel {x : H x = 0 (mod 2)} of binary matrix H.
+
+    Returns
+    -------
+    packed: 2D array of uint64
+        The basis vectors, packed row-wise (one per row).
+
+    n: int
+        Number of columns of H (length of the basis vectors).
+
+    """
+
+    R, n = pack(H) if not isinstance(H, tuple) else H
+    R, pivots = row_echelon((R, n))
+    R = R[:len(pivots)]
+    free = np.setdiff1d(np.arange(n), pivots)
+
+    # the kernel vector of free column f is e_f + sum_{i : R[i, f] = 1}
+    # e_{pivots[i]}
+    rows, cols = [np.arange(len(free))], [free]
+    for k, f in enumerate(free):
+        hits = np.nonzero(_column(R, f))[0]
+        rows.append(np.repeat(k, len(hits)))
+        cols.append(pivots[hits])
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    return pack(sp.coo_matrix((np.ones(len(rows), dtype=int), (rows, cols)),
+                              shape=(len(free), n)))
+
+
+def reduce_rows(echelon, X):
+    """
+    Reduces words modulo the row space of a matrix.
+
+    Parameters
+    ----------
+    echelon: pair (R, pivots)
+        Reduced row echelon form of the matrix, as returned by
+        `row_echelon(H)` (so that it can be computed once, and reused).
+
+    X: 2D array-like or scipy.sparse matrix, or (packed, n) pair
+        Words, one per row.
+
+    Returns
+    -------
+    packed: 2D array of uint64
+        The reduced words, packed; a word lies in the row space iff its
+        reduction is zero.
+
+    """
+
+    R, pivots = echelon
+    Xp, _ = X if isinstance(X, tuple) else pack(X)
+    Xp = Xp.copy()
+    for i, j in enumerate(pivots):
+        # R is reduced: row i is the only one to hit pivot column j
+        hits = _column(Xp, j).astype(bool)
+        Xp[hits] ^= R[i]
+    return Xp
+
+
+def in_rowspace(H, X):
+    """
+    Whether each row of X lies in the row space of H, over GF(2).
+
+    """
+
+    return ~reduce_rows(row_echelon(H), X).any(axis=1)
+
+
+def syndromes(H, X):
+    """
+    Batched syndrome computation: H x^T (mod 2), for each row x of X.
+
+    Parameters
+    ----------
+    H: 2D array-like or scipy.sparse matrix, of shape (m, n)
+        Parity-check matrix.
+
+    X: 2D array-like or scipy.sparse matrix, of shape (k, n)
+        Words, one per row.
+
+    Returns
+    -------
+    S: 2D array of shape (k, m) of uint8
+        Syndromes, one per row.
+
+    """
+
+    if sp.issparse(H) and not sp.issparse(X) and len(np.shape(X)) == 2:
+        # sparse checks against unpacked words: cheapest is a sparse product
+        X = np.asarray(X, dtype=int) % 2
+        return (sp.csr_matrix(H, dtype=int).dot(X.T).T % 2).astype(np.uint8)
+
+    Hp, n = pack(H)
+    Xp, n_ = pack(X)
+    assert n == n_, "H has %i columns, but words have length %i" % (n, n_)
+    acc = np.zeros((len(Xp), len(Hp)), dtype=np.uint64)
+    for w in xrange(Hp.shape[1]):
+        acc ^= Xp[:, w, np.newaxis] & Hp[np.newaxis, :, w]
+    return _parity(acc)
+
+
+def code_dimension(H):
+    """
+    Dimension k = n - rank(H) of the binary code with parity-check matrix H.
+
+    """
+
+    return H.shape[1] - rank(H)
+
+
+def css_commute(GX, GZ):
+    """
+    Checks the CSS condition GX GZ^T = 0 (mod 2).
+
+    """
+
+    if sp.issparse(GX) or sp.issparse(GZ):
+        prod = sp.csr_matrix(GX, dtype=int).dot(sp.csr_matrix(
+                GZ, dtype=int).T)
+        return not (prod.data % 2).any()
+    return not syndromes(GX, GZ).any()
+
+
+def css_code_parameters(GX, GZ):
+    """
+    Parameters [n, k] of the CSS code with X checks GX and Z checks GZ,
+    namely n = number of qubits and k = n - rank(GX) - rank(GZ).
+
+    """
+
+    assert GX.shape[1] == GZ.shape[1]
+    assert css_commute(GX, GZ), "GX GZ^T != 0: not a CSS code!"
+    n = GX.shape[1]
+    return n, n - rank(GX) - rank(GZ)
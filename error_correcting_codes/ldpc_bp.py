@@ -4,23 +4,221 @@
 
 """
 
+import time
 import itertools
 import numpy as np
 import pylab as pl
-import networkx as nx
+from codes import (parmat2checks, checks2parmat, parmat2graph,
+                   tanner_adjacency, is_parmat, check_rng)
+
+# cap on the magnitude of log-likelihood ratios (keeps arithmetic on messages
+# finite, e.g for checks of degree 1)
+LLR_MAX = 1e6
+
+# per-round metrics of BP, as recorded in `LdpcBpDecoder.trace_`
+TRACE_DTYPE = [("iteration", int), ("frames", int), ("unsatisfied", float),
+               ("mean_abs_llr", float), ("delta", float), ("time", float)]
 
 # aribirary dimensional hypercube generator
 hypercube = lambda n: itertools.product(*([[0, 1]] * n))
 
 
+class BpPlan(object):
+    """
+    Compiled form of a code, for BP decoding: the adjacency arrays of its
+    Tanner graph, the layers of the layered schedule, and the scratch buffers
+    of the message-passing kernels. A plan does not depend on the channel,
+    so one plan can back any number of decoders (channel models, noise
+    levels, schedules): build it once with `compile_code`, and pass it to
+    `LdpcBpDecoder` in place of the checks.
+
+    Scratch buffers are shared by all the decoders using the plan, so these
+    must not decode concurrently (from several threads).
+
+    Parameters
+    ----------
+    codelength: int
+        Number of variable nodes (columns of the parity-check matrix).
+
+    checks: list of lists of integers, or parity-check matrix
+        The code (see `LdpcBpDecoder`).
+
+    Attributes
+    ----------
+    check_ptr, edge_vars, var_ptr, var_edges, edge_checks: arrays of integers
+        Tanner-graph adjacency, see the attributes of `LdpcBpDecoder` with
+        the same names.
+
+    check_starts, edge_segments: arrays of integers
+        Segment starts (for reduceat) of the checks having edges, and rank
+        of the check of each edge among these (empty checks have no
+        segment: a reduceat segment can't be empty).
+
+    layers: list of tuples (edges, vars, starts, segments) of arrays
+        Layers of checks with disjoint supports, for the layered schedule
+        (built on first access): edges of the layer grouped check-by-check,
+        their variable nodes, and the segment starts / segment of each edge
+        for the check-node reductions.
+
+    """
+
+    def __init__(self, codelength, checks):
+        self.codelength = codelength
+        if is_parmat(checks, codelength):
+            assert checks.shape[1] == codelength
+            self.parmat = checks
+            checks = parmat2checks(checks)
+        self.checks = checks
+        self.nchecks = len(checks)
+
+        self.check_ptr, self.edge_vars, self.var_ptr, self.var_edges = (
+            tanner_adjacency(self.checks, nvars=codelength,
+                             parmat=getattr(self, "parmat", None)))
+        degrees = np.diff(self.check_ptr)
+        self.nedges = len(self.edge_vars)
+        self.edge_checks = np.repeat(np.arange(self.nchecks), degrees)
+
+        # segment starts of the check nodes having edges
+        self.check_has_edges = degrees > 0
+        self.check_starts = self.check_ptr[:-1][self.check_has_edges]
+        self.edge_segments = (np.cumsum(self.check_has_edges) - 1)[
+            self.edge_checks]
+        self.empty_checks = np.nonzero(~self.check_has_edges)[0]
+
+        # segment starts of the variable nodes having edges
+        var_degrees = np.diff(self.var_ptr)
+        self.var_has_edges = var_degrees > 0
+        self.var_starts = self.var_ptr[:-1][self.var_has_edges]
+        self.isolated_vars = np.nonzero(~self.var_has_edges)[0]
+
+        # rank of each variable node among those having edges
+        self.var_pos = np.cumsum(self.var_has_edges) - 1
+
+        self._layers = None
+        self._graph = None
+        self._pseudos = None
+        self._bases = {}
+        self._views = {}
+
+    @property
+    def layers(self):
+        """
+        Greedy coloring of the check nodes, such that checks of the same
+        color (layer) share no variable node.
+
+        """
+
+        if self._layers is not None: return self._layers
+        colors = np.zeros(self.nchecks, dtype=int)
+        var_colors = [set() for _ in xrange(self.codelength)]
+        for cn, check in enumerate(self.checks):
+            used = set().union(*[var_colors[vn] for vn in check])
+            color = 0
+            while color in used: color += 1
+            colors[cn] = color
+            for vn in check: var_colors[vn].add(color)
+
+        # edges of each layer, grouped check-by-check
+        self._layers = []
+        colors[~self.check_has_edges] = -1  # empty checks constrain nothing
+        for color in xrange(colors.max() + 1 if self.nchecks else 0):
+            cns = np.nonzero(colors == color)[0]
+            degrees = np.diff(self.check_ptr)[cns]
+            edges = np.concatenate([np.arange(
+                        self.check_ptr[cn], self.check_ptr[cn + 1])
+                                    for cn in cns])
+            self._layers.append((edges, self.edge_vars[edges], np.append(
+                        0, np.cumsum(degrees))[:-1], np.repeat(
+                        np.arange(len(cns)), degrees)))
+        return self._layers
+
+    @property
+    def graph(self):
+        """
+        Bipartite graph representation of the code (generated on first
+        access, i.e only for plotting).
+
+        """
+
+        if self._graph is None:
+            self._graph = parmat2graph(
+                self.parmat if hasattr(self, "parmat") else checks2parmat(
+                    self.checks, nvars=self.codelength))[0]
+        return self._graph
+
+    @property
+    def pseudos(self):
+        """
+        Node pseudos (generated on first access, i.e only when printing).
+
+        """
+
+        if self._pseudos is None:
+            self._pseudos = {}
+            for node in xrange(self.codelength + self.nchecks):
+                self._pseudos[node] = (
+                    "BIT_%i" % node if node < self.codelength else (
+                        "[%s = 0]" % (" XOR ".join(
+                                ["BIT_%i" % b for b in self.checks[
+                                        node - self.codelength]]))))
+        return self._pseudos
+
+    def scratch(self, name, shape, dtype=float):
+        """
+        Scratch array of given shape and dtype, with undefined content.
+
+        Each name is backed by one flat buffer, grown on demand and then
+        reused: asking again for a buffer of the same name (with any shape
+        that fits) allocates nothing. Different names never alias.
+
+        """
+
+        key = (name, shape, dtype)
+        view = self._views.get(key)
+        if view is None:
+            size = int(np.prod(shape))
+            base = self._bases.get(name)
+            if base is None or base.dtype != dtype or base.size < size:
+                base = self._bases[name] = np.empty(max(size, 1), dtype)
+                for old in [k for k in self._views if k[0] == name]:
+                    del self._views[old]
+            if len(self._views) > 4096: self._views.clear()
+            view = self._views[key] = base[:size].reshape(shape)
+        return view
+
+
+def compile_code(checks, codelength=None):
+    """
+    Compiles a code into a `BpPlan`, to be shared by several decoders.
+
+    Parameters
+    ----------
+    checks: list of lists of integers, or parity-check matrix
+        The code (see `LdpcBpDecoder`).
+
+    codelength: int, optional (default None)
+        Length of the code. Inferred from checks if None.
+
+    """
+
+    if codelength is None:
+        if is_parmat(checks): codelength = checks.shape[1]
+        else: codelength = 1 + max(map(max, checks))
+    return BpPlan(codelength, checks)
+
+
 class LdpcBpDecoder(object):
     """
     Believe Propagation decoder for LDPCs (Low-Density Parity-Check Codes).
 
     Parameters
     ----------
-    checks: list of lists of integers
-        The supports of the rows of the parity matric of the code.
+    checks: list of lists of integers, parity-check matrix, or `BpPlan`
+        The supports of the rows of the parity matric of the code. The
+        parity-check matrix itself (dense 0/1 array with `codelength`
+        columns, or scipy.sparse matrix, as returned by the constructions in
+        `codes.py`; see `codes.is_parmat`) is also accepted, as is a plan
+        returned by `compile_code`, in which case nothing is recompiled.
 
     channel_model: string, optional (default None)
         Noise model in chanel.
@@ -29,18 +227,67 @@ class LdpcBpDecoder(object):
         'AWGN': Additive White Gaussian Noise. Here, snr must be specified.
 
     p: float in the open interval (0, 1), optional (default None)
-        Crossover probability of BSC channel.
+        Crossover probability of BSC channel. The channel parameters can be
+        changed later on with `set_channel`, or for a given call to `fit` /
+        `decode_batch`.
 
     snr: float, optional (default None)
         SNR for AWGN channel.
 
-    verbose: int, optional (default 1)
-        Verbosity level.
+    verbose: int, optional (default 0)
+        Verbosity level. With the 'graph' engine, verbose > 1 also prints
+        every message.
+
+    callback: callable, optional (default None)
+        Tracing hook, called as callback(decoder, record) after each round
+        of BP, where record is a dict with the fields of `TRACE_DTYPE`:
+        iteration number, number of frames being decoded, number of
+        unsatisfied checks and mean |LLR| (per frame), mean absolute change
+        of the check-to-variable messages ('edges' engine only) and wall time
+        since decoding started. Metrics are only computed if a callback is
+        given or if `trace` is set, so tracing costs nothing when disabled.
+
+    trace: bool, optional (default False)
+        If set, the records of the last call to `fit` / `decode_batch` are
+        collected in `self.trace_`.
+
+    engine: string, optional (default "edges")
+        Message-passing engine.
+        Possible values are:
+        'edges': messages live in flat arrays indexed by the edges of the
+        Tanner graph, and each round is a handful of vectorized segment
+        reductions (sums at variable nodes, sign parities and min / second
+        min at check nodes).
+        'graph': the original node-by-node engine, where packets are routed
+        through the `pkts_` dict. Very slow, but prints every message (useful
+        for teaching purposes).
+
+    schedule: string, optional (default "flooding")
+        Order in which check nodes are updated ('edges' engine only).
+        Possible values are:
+        'flooding': all variable nodes, then all check nodes, on each round.
+        'layered': the checks are split into layers of checks with disjoint
+        supports, and the posteriors are updated after each layer; one round
+        is a sweep through all the layers. Typically converges in about half
+        as many rounds as flooding.
+        'residual': informed dynamic scheduling. Like 'layered', but the
+        layers are picked on the fly: at each step, a maximal set of
+        non-overlapping checks is updated, by decreasing residual (largest
+        change in an outgoing message). One round updates every check with
+        a non-zero residual once; since residuals are recomputed for all
+        checks after each step, a round is several times as expensive as a
+        flooding round.
 
     Attributes
     ----------
-    graphs_: nx.Graph object
-        Graphical representation of the LDPC as a bipartite graph.
+    plan_: `BpPlan` object
+        The compiled code: adjacency arrays, and scratch buffers in which the
+        messages are passed, so that the rounds of BP allocate nothing.
+
+    graph_: nx.Graph object
+        Graphical representation of the LDPC as a bipartite graph. Built on
+        first access (e.g for plotting); decoding only uses the compact
+        adjacency arrays below.
 
     nchecks_: int
         Number of check nodes (i.e number of rows in parity-check matrix).
@@ -51,8 +298,30 @@ class LdpcBpDecoder(object):
     var_nodes_: list of `self.codelength` integers
         The variable nodes.
 
+    edge_vars_: array of `self.nedges_` integers
+        Variable-node endpoint of each edge. Edges are enumerated
+        check-by-check, in the order given by `self.checks`.
+
+    var_ptr_, var_edges_: arrays of integers
+        Edges of variable node v are `var_edges_[var_ptr_[v]:var_ptr_[v + 1]]`
+        (see `codes.tanner_adjacency`).
+
+    edge_checks_: array of `self.nedges_` integers
+        Check-node index (row of the parity-check matrix) of each edge.
+
+    check_ptr_: array of `self.nchecks_ + 1` integers
+        Edges of check c are `check_ptr_[c]:check_ptr_[c + 1]`.
+
     pkts_: dict with items (src, dst) -> pkt
-        Packets sent at last iteration.
+        Packets sent at last iteration ('graph' engine only).
+
+    v2c_: array of `self.nedges_` floats
+        Variable-to-check messages sent at last iteration ('edges' engine
+        only).
+
+    c2v_: array of `self.nedges_` floats
+        Check-to-variable messages sent at last iteration ('edges' engine
+        only).
 
     self.llrs_: list of `self.codelength` floats
         Initial log-likelihood ratios, given the received word.
@@ -60,6 +329,18 @@ class LdpcBpDecoder(object):
     self.l_: list of `self.codelength` floats
         Final log-likelihood ratios.
 
+    self.n_iter_: int
+        Number of BP rounds run by the last call to `fit`.
+
+    self.trace_: structured array with dtype `TRACE_DTYPE`
+        Per-round metrics of the last call to `fit` or `decode_batch` (only
+        if `trace` is set). For `decode_batch`, iteration numbers restart
+        with each chunk of frames.
+
+    pseudos_: dict
+        Human-readable names of the nodes, for printing. Built on first
+        access.
+
     self.x_: array of `self.codelength` bits
         MAP codeword decoded from the received word.
 
@@ -70,9 +351,38 @@ class LdpcBpDecoder(object):
     """
 
     def __init__(self, codelength, checks, channel_model=None, p=None,
-                 snr=None, verbose=1):
+                 snr=None, verbose=0, engine="edges", schedule="flooding",
+                 callback=None, trace=False):
 
         self.verbose = verbose
+        self.callback = callback
+        self.trace = trace
+        assert engine in ["edges", "graph"], (
+            "Unsupported engine: %s" % engine)
+        assert schedule in ["flooding", "layered", "residual"], (
+            "Unsupported schedule: %s" % schedule)
+        assert engine == "edges" or schedule == "flooding", (
+            "The 'graph' engine only has a flooding schedule")
+        self.engine = engine
+        self.schedule = schedule
+        self.set_channel(channel_model=channel_model, p=p, snr=snr)
+
+        # the code itself is compiled once (adjacency arrays, scratch
+        # buffers), and possibly shared with other decoders
+        if isinstance(checks, BpPlan):
+            assert checks.codelength == codelength
+            self.plan_ = checks
+        else: self.plan_ = BpPlan(codelength, checks)
+        self.codelength = codelength
+        self._bind_plan()
+
+    def set_channel(self, channel_model=None, p=None, snr=None):
+        """
+        (Re)sets the channel parameters. This is cheap: the code is not
+        recompiled, so that a decoder can be reused across noise levels.
+
+        """
+
         if channel_model is None:
             if not p is None: channel_model = "BSC"
         if channel_model is None:
@@ -85,47 +395,67 @@ class LdpcBpDecoder(object):
             assert not p is None
             assert 0 < p < 1., (
                 "p must be in the open interval (0, 1); got %g" % p)
+        else: assert not snr is None
         self.p = p
         self.snr = snr
         self.channel_model = channel_model
-        self.codelength = codelength
-        self.checks = checks
-        self.nchecks_ = len(checks)
-
-        # bipartite graph representation of the LDPC
-        self.graph_ = nx.Graph()
+        return self
 
-        # add variable nodes
-        self.var_nodes_ = xrange(codelength)
-        self.graph_.add_nodes_from(self.var_nodes_, bipartite=0)
+    def _bind_plan(self):
+        plan = self.plan_
+        if hasattr(plan, "parmat"): self.parmat_ = plan.parmat
+        self.checks = plan.checks
+        self.nchecks_ = plan.nchecks
+
+        # variable nodes, then "check" / factor nodes
+        self.var_nodes_ = xrange(self.codelength)
+        self.check_nodes_ = xrange(self.codelength,
+                                   self.codelength + self.nchecks_)
+
+        # flat edge arrays (built once, reused by every round of BP)
+        self.check_ptr_, self.edge_vars_ = plan.check_ptr, plan.edge_vars
+        self.var_ptr_, self.var_edges_ = plan.var_ptr, plan.var_edges
+        self.edge_checks_, self.nedges_ = plan.edge_checks, plan.nedges
+        self._check_starts = plan.check_starts
+        self._edge_segments = plan.edge_segments
+        self._check_has_edges = plan.check_has_edges
+        self._var_has_edges = plan.var_has_edges
+        self._var_starts = plan.var_starts
+        self._var_pos = plan.var_pos
+        self._buf = plan.scratch
+
+    @property
+    def layers_(self):
+        return self.plan_.layers
+
+    @property
+    def graph_(self):
+        return self.plan_.graph
+
+    @property
+    def pseudos_(self):
+        return self.plan_.pseudos
 
-        # add "check" / factor nodes
-        self.check_nodes_ = xrange(codelength, codelength + self.nchecks_)
-        self.graph_.add_nodes_from(self.check_nodes_, bipartite=1)
+    def compute_llr(self, obs):
+        """
+        Compute (initial) log-likelihood ratios, given evidence.
 
-        # connect variable and check nodes
-        for cn, check in zip(self.check_nodes_, checks):
-            for vn in check: self.graph_.add_edge(cn, vn)
+        """
 
-        # generate node pseudos
-        self.pseudos_ = {}
-        for node in self.graph_.nodes():
-            self.pseudos_[node] = (
-                "BIT_%i" % node if node < self.codelength else "[%s = 0]" % (
-                    " XOR ".join(["BIT_%i" % b for b in self.checks[
-                                node - self.codelength]])))
+        self.llrs_ = self._llrs(obs)
 
-    def compute_llr(self, obs):
+    def _llrs(self, obs):
         """
-        Compute (initial) log-likelihood ratios, given evidence.
+        Channel log-likelihood ratios of a word (or of a batch of words, one
+        per row).
 
         """
 
         if self.channel_model == "BSC":
             q = 1. - self.p
-            self.llrs_ = -np.log([self.p / q, q / self.p])[obs]
+            return -np.log([self.p / q, q / self.p])[np.asarray(obs)]
         elif self.channel_model == "AWGN":
-            self.llrs_ = 4 * np.array(obs) * self.snr
+            return 4 * np.array(obs) * self.snr
 
     def recv(self, node):
         """
@@ -142,7 +472,7 @@ class LdpcBpDecoder(object):
 
         """
 
-        if self.verbose: print "\t\t%s -> %s:" % (
+        if self.verbose > 1: print "\t\t%s -> %s:" % (
             self.pseudos_[src], self.pseudos_[dst]), pkt
         self.pkts_[(src, dst)] = pkt
 
@@ -161,7 +491,8 @@ class LdpcBpDecoder(object):
         self.x_[vn] = self.l_[vn] <= 0.
 
         # spread the rumours
-        for cn in self.graph_.neighbors(vn):
+        for cn in self.edge_checks_[self.var_edges_[
+                self.var_ptr_[vn]:self.var_ptr_[vn + 1]]] + self.codelength:
             pkt = np.sum([pkt for src, pkt in inbox.iteritems(
                         ) if src != cn])  # rumours
             pkt += self.llrs_[vn]  # our own belief
@@ -180,7 +511,9 @@ class LdpcBpDecoder(object):
         inbox = self.recv(cn)
 
         # spread the rumours
-        for vn in self.graph_.neighbors(cn):
+        cn_ = cn - self.codelength
+        for vn in self.edge_vars_[
+                self.check_ptr_[cn_]:self.check_ptr_[cn_ + 1]]:
             # accumulate pkts from other neighboring variable nodes
             signs, mags = zip(*[pkt for src, pkt in inbox.iteritems(
                         ) if src != vn])
@@ -189,35 +522,410 @@ class LdpcBpDecoder(object):
             # send pkt from cn to vn
             self.send(cn, vn, pkt)
 
-    def is_codeword(self, x):
-        bits = np.array(x, dtype=int) % 2
-        for check in self.checks:
-            if bits[check].sum() % 2: return false
-        else: return True
+    def _var_sums(self, c2v, out=None):
+        """
+        Sum of incoming check-to-variable messages, at each variable node.
+
+        Here (and in the other edge kernels below) the edges run along the
+        first axis; a batch of words is handled by stacking them along a
+        second axis, so that segment reductions stay contiguous in memory.
+        Intermediate results live in the scratch buffers of the plan, and
+        the result is written into `out` if given.
 
-    def fit(self, obs, max_iter=100):
         """
-        BP decoding of a corrupt word. See Algorithm 4 of [1].
 
-        Parameters
-        ----------
-        obs: array of `self.codelength` bits
-            Observed word.
+        shape = (self.codelength,) + c2v.shape[1:]
+        if out is None: out = np.empty(shape)
+        plan = self.plan_
+        if not self.nedges_:
+            out[...] = 0.
+            return out
+        gathered = np.take(c2v, self.var_edges_, axis=0, mode="clip",
+                           out=self._buf("vs_gathered", c2v.shape))
+        if not len(plan.isolated_vars):
+            return np.add.reduceat(gathered, self._var_starts, axis=0,
+                                   out=out)
+        out[plan.isolated_vars] = 0.
+        out[self._var_has_edges] = np.add.reduceat(
+            gathered, self._var_starts, axis=0, out=self._buf(
+                "vs_sums", (len(self._var_starts),) + c2v.shape[1:]))
+        return out
+
+    def _minsum(self, v2c, starts, segments, out=None):
+        """
+        Min-sum update at checks whose edges are the consecutive segments of
+        v2c starting at `starts`: each edge receives the product of the signs
+        and the min of the magnitudes of the other edges of its check.
+        `segments` gives the segment of each edge. A check of degree 1 forces
+        its bit to 0, with LLR `LLR_MAX`.
 
         """
 
-        # sanitize observation
-        if self.verbose: print "BP: initialization (loadin evidence...)"
-        assert len(obs) == self.codelength
-        if self.channel_model == "BSC":
-            for ob in obs: assert ob in [0, 1]
+        buf = self._buf
+        shape = v2c.shape
+        cshape = (len(starts),) + shape[1:]
+        if out is None: out = np.empty(shape)
+        signs = np.less_equal(v2c, 0., out=buf("ms_signs", shape, bool))
+        mags = np.abs(v2c, out=buf("ms_mags", shape))
+
+        # sign parities, leaving out each edge in turn
+        parities = np.add.reduceat(signs, starts, axis=0, dtype=np.intp,
+                                   out=buf("ms_cparities", cshape, np.intp))
+        parities = np.take(parities, segments, axis=0, mode="clip",
+                           out=buf("ms_parities", shape, np.intp))
+        np.bitwise_xor(parities, signs, out=parities)
+        np.bitwise_and(parities, 1, out=parities)
+
+        # min and second min of magnitudes
+        cmins = np.minimum.reduceat(mags, starts, axis=0,
+                                    out=buf("ms_cmins", cshape))
+        min1 = np.take(cmins, segments, axis=0, mode="clip",
+                       out=buf("ms_min1", shape))
+        is_min = np.equal(mags, min1, out=buf("ms_is_min", shape, bool))
+        n_mins = np.add.reduceat(is_min, starts, axis=0, dtype=np.intp,
+                                 out=buf("ms_n_mins", cshape, np.intp))
+        np.copyto(mags, LLR_MAX, where=is_min)
+        np.minimum.reduceat(mags, starts, axis=0, out=cmins)
+        min2 = np.take(cmins, segments, axis=0, mode="clip",
+                       out=buf("ms_min2", shape))
+        unique_min = np.take(n_mins, segments, axis=0, mode="clip",
+                             out=buf("ms_edge_n_mins", shape, np.intp))
+        unique_min = np.equal(unique_min, 1, out=buf(
+                "ms_unique_min", shape, bool))
+        np.logical_and(unique_min, is_min, out=unique_min)
+        np.copyto(min1, min2, where=unique_min)
+
+        # signs: 1 - 2 * parity
+        np.multiply(parities, -2, out=parities)
+        parities += 1
+        return np.multiply(min1, parities, out=out)
+
+    def _check_update(self, v2c, out=None):
+        """
+        Min-sum update at all check nodes.
+
+        """
+
+        return self._minsum(v2c, self._check_starts, self._edge_segments,
+                            out=out)
+
+    def _check_reduce(self, ufunc, edge_vals, empty, name):
+        """
+        Reduction with ufunc of edge values over the edges of each check
+        (`empty` for the checks without edges), into a scratch array.
+
+        """
+
+        shape = edge_vals.shape[1:]
+        dtype = edge_vals.dtype
+        reduced = ufunc.reduceat(edge_vals, self._check_starts, axis=0,
+                                 out=self._buf(name + "_segments", (
+                    len(self._check_starts),) + shape, dtype))
+        if not len(self.plan_.empty_checks): return reduced
+        out = self._buf(name, (self.nchecks_,) + shape, dtype)
+        out[self._check_has_edges] = reduced
+        out[self.plan_.empty_checks] = empty
+        return out
+
+    def _syndrome(self, x):
+        """
+        Parities of the checks, for hard decisions x (a scratch array, valid
+        until the next call).
+
+        """
+
+        gathered = np.take(x, self.edge_vars_, axis=0, mode="clip",
+                           out=self._buf("syn_gathered", (
+                    self.nedges_,) + x.shape[1:], x.dtype))
+        parities = self._check_reduce(np.add, gathered, 0, "syn_parities")
+        return np.bitwise_and(parities, 1, out=parities)
+
+    def _init_state(self, llrs):
+        """
+        Initial messages (and posteriors) of the current schedule, for a word
+        (or for a batch of words, one per column).
+
+        The state arrays live in two sets of scratch buffers ("sides"): a
+        round reads the state from one side and writes the next state into
+        the other one, so that BP runs without allocating.
+
+        """
+
+        shape = (self.nedges_,) + llrs.shape[1:]
+        c2v = self._buf("c2v0", shape)
+        c2v[...] = 0.
+        if self.schedule == "flooding":
+            v2c = self._buf("v2c0", shape)
+            v2c[...] = np.nan
+            return dict(c2v=c2v, v2c=v2c, side=0)
+        else:
+            l = self._buf("l0", llrs.shape)
+            l[...] = llrs
+            return dict(c2v=c2v, l=l, side=0)
+
+    def _compact(self, arrays, keep):
+        """
+        Keeps the columns (frames) `keep` of the arrays of a state, moving
+        them into the scratch buffers of the other side.
+
+        """
+
+        side = 1 - arrays["side"]
+        n_kept = np.count_nonzero(keep)
+        compacted = dict(side=side)
+        for key, val in arrays.items():
+            if key == "side": continue
+            compacted[key] = np.compress(keep, val, axis=1, out=self._buf(
+                    "%s%i" % (key, side), (len(val), n_kept), val.dtype))
+        return compacted
+
+    def _round(self, llrs, state, signs=None):
+        """
+        One round of BP, with the current schedule. The rounds below work on
+        a single word or on a batch (one per column).
+
+        In syndrome mode (see `decode_syndromes`), `signs` holds -1 on the
+        edges of the checks with a non-zero syndrome bit (and +1 elsewhere):
+        the messages such checks send are negated.
+
+        Returns
+        -------
+        l: array like `llrs`
+            Posterior log-likelihood ratios (a scratch array).
+
+        state: dict of arrays
+            Updated messages (and posteriors).
+
+        stalled: bool (or array of bools, one per word)
+            Whether the messages have stopped changing.
+
+        """
+
+        return getattr(self, "_%s_round" % self.schedule)(llrs, state,
+                                                          signs)
+
+    def _stalled(self, new, old, name="stalled"):
+        """
+        Whether the messages of each word did not change (in the scratch
+        buffer of given name).
+
+        """
+
+        same = np.equal(new, old, out=self._buf("same", new.shape, bool))
+        return np.logical_and.reduce(same, axis=0, out=self._buf(
+                name, new.shape[1:], bool))
+
+    def _flooding_round(self, llrs, state, signs):
+        """
+        Flooding schedule: all variable nodes, then all check nodes.
+
+        """
+
+        buf = self._buf
+        c2v, side = state["c2v"], 1 - state["side"]
+        l = self._var_sums(c2v, out=buf("l%i" % side, llrs.shape))
+        v2c = np.take(l, self.edge_vars_, axis=0, mode="clip",
+                      out=buf("v2c%i" % side, c2v.shape))
+        v2c -= c2v
+        v2c += np.take(llrs, self.edge_vars_, axis=0, mode="clip",
+                       out=buf("edge_llrs", c2v.shape))
+        l += llrs
+        c2v_ = self._check_update(v2c, out=buf("c2v%i" % side, c2v.shape))
+        if signs is not None: c2v_ *= signs
+        stalled = self._stalled(v2c, state["v2c"])
+        stalled &= self._stalled(c2v_, c2v, name="stalled_c2v")
+        return l, dict(c2v=c2v_, v2c=v2c, side=side), stalled
+
+    def _layered_round(self, llrs, state, signs):
+        """
+        Layered (row-serial) schedule: the posteriors of the variable nodes
+        are refreshed after each layer of checks.
+
+        """
+
+        buf = self._buf
+        side = 1 - state["side"]
+        l = buf("l%i" % side, llrs.shape)
+        l[...] = state["l"]
+        c2v = buf("c2v%i" % side, state["c2v"].shape)
+        c2v[...] = state["c2v"]
+        frames = llrs.shape[1:]
+        for edges, vns, starts, segments in self.layers_:
+            shape = (len(edges),) + frames
+            v2c = np.take(l, vns, axis=0, mode="clip",
+                          out=buf("layer_v2c", shape))
+            v2c -= np.take(c2v, edges, axis=0, mode="clip",
+                           out=buf("layer_c2v", shape))
+            c2v_ = self._minsum(v2c, starts, segments,
+                                out=buf("layer_c2v", shape))
+            if signs is not None:
+                c2v_ *= np.take(signs, edges, axis=0, mode="clip",
+                                out=buf("layer_signs", shape))
+            c2v[edges] = c2v_
+            v2c += c2v_
+            l[vns] = v2c  # checks of a layer share no vn
+        stalled = self._stalled(c2v, state["c2v"])
+        return l, dict(c2v=c2v, l=l, side=side), stalled
+
+    def _independent_checks(self, residuals):
+        """
+        Greedy maximal set of checks with positive residuals, no two of which
+        share a variable node, picked by decreasing residual. Luby-style:
+        each pass keeps the checks whose residual is the largest of their
+        neighborhood, then drops their neighbors.
+
+        """
+
+        # unique priorities: larger residual first, then smaller index
+        order = np.argsort(-residuals, axis=0, kind="mergesort")
+        priorities = np.empty(order.shape, dtype=int)
+        ranks = np.arange(self.nchecks_)[::-1]
+        if order.ndim == 1: priorities[order] = ranks
+        else: priorities[order, np.arange(order.shape[1])] = ranks[:, None]
+
+        def var_max(edge_vals):
+            # max of edge values at each variable node, mapped back to edges
+            best = np.maximum.reduceat(edge_vals[self.var_edges_],
+                                       self._var_starts, axis=0)
+            return best[self._var_pos[self.edge_vars_]]
+
+        def check_all(edge_flags):
+            # empty checks are never candidates
+            return self._check_reduce(np.minimum, edge_flags.astype(int), 0,
+                                      "ic_flags").astype(bool)
+
+        candidates = residuals > 0
+        selected = np.zeros(residuals.shape, dtype=bool)
+        while candidates.any():
+            edge_priorities = np.where(candidates[self.edge_checks_],
+                                       priorities[self.edge_checks_], -1)
+            winners = candidates & check_all(
+                edge_priorities == var_max(edge_priorities))
+            selected |= winners
+            blocked = var_max(selected[self.edge_checks_].astype(int)) > 0
+            candidates &= check_all(~blocked)
+
+        return selected
+
+    def _residual_round(self, llrs, state, signs):
+        """
+        Residual (informed dynamic) schedule: a round is a sequence of steps,
+        each of which updates a maximal set of non-overlapping checks,
+        largest residual first, and refreshes the posteriors. The residuals
+        are recomputed after each step, and a round ends when every check
+        has been updated or has zero residual.
+
+        """
+
+        l, c2v = state["l"], state["c2v"]
+        pending = self._check_has_edges.reshape(
+            (-1,) + (1,) * (llrs.ndim - 1)) & np.ones(l.shape[1:], dtype=bool)
+        stalled = True
+        while True:
+            c2v_ = self._check_update(l[self.edge_vars_] - c2v)
+            if signs is not None: c2v_ *= signs
+            changed = c2v_ != c2v
+            residuals = self._check_reduce(np.maximum, np.where(
+                    changed, np.abs(c2v_ - c2v), 0.), 0., "rs_residuals")
+            residuals[~pending] = 0.
+            if not (residuals > 0).any(): break
+
+            selected = self._independent_checks(residuals)
+            update = selected[self.edge_checks_] & changed
+            l = l + self._var_sums(np.where(update, c2v_ - c2v, 0.))
+            c2v = np.where(update, c2v_, c2v)
+            pending &= ~selected
+            stalled = stalled & ~selected.any(axis=0)
+
+        return l, dict(c2v=c2v, l=l, side=state["side"]), stalled
+
+    def _tracing(self):
+        return self.trace or self.callback is not None
+
+    def _trace_round(self, it, tic, l, syndrome, c2v_old=None, c2v=None):
+        """
+        Records the metrics of a round of BP (for a word, or a batch of words
+        laid out column-wise), and calls the tracing hook.
+
+        """
+
+        n_frames = l[0].size
+        record = dict(
+            iteration=it + 1, frames=n_frames,
+            unsatisfied=syndrome.sum() / float(n_frames),
+            mean_abs_llr=np.abs(l).mean(),
+            delta=np.nan if c2v is None else np.abs(c2v - c2v_old).mean(),
+            time=time.time() - tic)
+        if self.trace: self._records.append(record)
+        if self.callback is not None: self.callback(self, record)
+
+    def _start_trace(self):
+        self._records = []
+        return time.time()
+
+    def _stop_trace(self):
+        if self.trace:
+            self.trace_ = np.array(
+                [tuple(record[field] for field, _ in TRACE_DTYPE)
+                 for record in self._records], dtype=TRACE_DTYPE)
+
+    def _fit_edges(self, max_iter):
+        """
+        Min-sum BP on flat edge arrays, with the current schedule. The
+        messages and posteriors live in the scratch buffers of the plan, and
+        are copied out once BP is over.
+
+        """
+
+        state = self._init_state(self.llrs_)
+        tracing, tic = self._tracing(), self._start_trace()
+        self.ok_ = False
+        x = self._buf("x", (self.codelength,), int)
+        for it in xrange(max_iter):
+            if self.verbose:
+                print "_" * 79
+                print "BP: iter %03i/%03i..." % (it + 1, max_iter)
+
+            # handle variable and "check" nodes
+            c2v_old = state["c2v"]
+            l, state, stalled = self._round(self.llrs_, state)
+            np.less_equal(l, 0., out=x)
+
+            # test for convergence
+            syndrome = self._syndrome(x)
+            if tracing:
+                self._trace_round(it, tic, l, syndrome, c2v_old,
+                                  state["c2v"])
+            if syndrome.any():
+                if self.verbose:
+                    check = self.checks[np.nonzero(syndrome)[0][0]]
+                    print "\tA check failed:  %s != 0" % " XOR ".join(
+                        map(str, x[check]))
+            else:
+                self.ok_ = True
+                if self.verbose: print "\tOK."
+                break
+
+            # abort if we've reached steady-state
+            if stalled: break
+
+        if max_iter:
+            self.l_, self.x_ = l.copy(), x.copy()
+            self.c2v_ = state["c2v"].copy()
+            self.v2c_ = state["v2c"].copy() if "v2c" in state else (
+                self.l_[self.edge_vars_] - self.c2v_)
+        return it
+
+    def _fit_graph(self, max_iter):
+        """
+        Flooding-schedule BP, node by node, with packets routed through a
+        dict.
+
+        """
 
-        # initialization
-        self.x_ = np.array(obs, dtype=int)
         old_pkts = None
         self.pkts_ = {}  # messages sent on the graph
-        self.compute_llr(obs)
-        self.l_ = np.ndarray(self.llrs_.shape)  # dynamic log-likelihood ratios
+        tracing, tic = self._tracing(), self._start_trace()
 
         # iterative BP (message passing) loop
         self.ok_ = False
@@ -236,6 +944,8 @@ class LdpcBpDecoder(object):
 
             # test for convergence
             if self.verbose: print "\tTesting for convergence..."
+            if tracing:
+                self._trace_round(it, tic, self.l_, self._syndrome(self.x_))
             for check in self.checks:
                 if self.x_[check].sum() % 2:
                     if self.verbose:
@@ -251,6 +961,49 @@ class LdpcBpDecoder(object):
             if self.pkts_ == old_pkts: break
             else: old_pkts = self.pkts_.copy()
 
+        return it
+
+    def is_codeword(self, x):
+        bits = np.array(x, dtype=int) % 2
+        return not self._syndrome(bits).any()
+
+    def fit(self, obs, max_iter=100, p=None, snr=None):
+        """
+        BP decoding of a corrupt word. See Algorithm 4 of [1].
+
+        Parameters
+        ----------
+        obs: array of `self.codelength` bits
+            Observed word.
+
+        max_iter: int, optional (default 100)
+            Maximum number of BP rounds.
+
+        p, snr: floats, optional (default None)
+            If given, the channel is reset before decoding (see
+            `set_channel`), e.g to decode at another noise level.
+
+        """
+
+        if not (p is None and snr is None): self.set_channel(p=p, snr=snr)
+
+        # sanitize observation
+        if self.verbose: print "BP: initialization (loadin evidence...)"
+        assert len(obs) == self.codelength
+        if self.channel_model == "BSC":
+            assert np.all((np.asarray(obs) == 0) | (np.asarray(obs) == 1))
+
+        # initialization
+        self.x_ = np.array(obs, dtype=int)
+        self.compute_llr(obs)
+        self.l_ = np.ndarray(self.llrs_.shape)  # dynamic log-likelihood ratios
+
+        # iterative BP (message passing) loop
+        if self.engine == "edges": it = self._fit_edges(max_iter)
+        else: it = self._fit_graph(max_iter)
+        self.n_iter_ = it + 1
+        self._stop_trace()
+
         # print results
         if self.verbose:
             print "_" * 79
@@ -271,11 +1024,201 @@ class LdpcBpDecoder(object):
 
         return self
 
-    def apply_bsc(self, codeword):
+    def decode_batch(self, obs, max_iter=100, batch_size=None, p=None,
+                     snr=None):
+        """
+        BP decoding of a batch of corrupt words, all at once. Uses the
+        'edges' engine, with the current schedule; each frame leaves the
+        batch as soon as it has been decoded (or its messages have stopped
+        changing), so that the work per round shrinks with the number of
+        frames still being decoded.
+
+        Parameters
+        ----------
+        obs: 2D array of shape (n_frames, `self.codelength`)
+            Observed words, one per row.
+
+        max_iter: int, optional (default 100)
+            Maximum number of BP rounds per frame.
+
+        batch_size: int, optional (default None)
+            Number of frames decoded side by side. Frames are processed in
+            chunks of this size, so that the message arrays stay cache
+            resident. If None, chunks of about 2^16 messages are used.
+
+        p, snr: floats, optional (default None)
+            If given, the channel is reset before decoding (see
+            `set_channel`).
+
+        Returns
+        -------
+        x: array of shape (n_frames, `self.codelength`) of bits
+            MAP codewords.
+
+        l: array of shape (n_frames, `self.codelength`) of floats
+            Final log-likelihood ratios.
+
+        n_iter: array of `n_frames` integers
+            Number of BP rounds run on each frame.
+
+        ok: array of `n_frames` booleans
+            Whether each frame was decoded into a codeword.
+
+        """
+
+        if not (p is None and snr is None): self.set_channel(p=p, snr=snr)
+        obs = np.atleast_2d(obs)
+        assert obs.ndim == 2 and obs.shape[1] == self.codelength
+        if self.channel_model == "BSC":
+            assert np.all((obs == 0) | (obs == 1))
+        llrs = self._llrs(obs.astype(int) if self.channel_model == "BSC"
+                          else obs)
+        return self._decode_frames(llrs, max_iter, batch_size)
+
+    def decode_syndromes(self, syndromes, max_iter=100, batch_size=None,
+                         llrs=None, p=None):
+        """
+        Syndrome-based BP decoding of a batch of error patterns: given the
+        syndromes s = H e (mod 2), estimates the most likely errors e. The
+        messages are those of `decode_batch`, except that checks with
+        s_c = 1 flip the sign of what they send; a frame has converged once
+        its hard decisions reproduce its syndrome. Bits with a posterior LLR
+        of exactly 0 (ties, frequent with degenerate codes) are decided as
+        error-free. This is the decoding
+        problem of quantum (CSS) codes, see `qldpc_bp.py`.
+
+        Parameters
+        ----------
+        syndromes: 2D array of shape (n_frames, `self.nchecks_`)
+            Syndromes, one per row.
+
+        max_iter, batch_size: see `decode_batch`
+
+        llrs: 2D array of shape (n_frames, `self.codelength`), optional
+            Prior log-likelihood ratios log(P(e_i = 0) / P(e_i = 1)) of each
+            bit of each frame. Defaults to log((1 - p) / p) everywhere, for
+            the crossover probability p of the BSC channel.
+
+        p: float, optional (default None)
+            If given, the BSC channel is reset before decoding.
+
+        Returns
+        -------
+        e: array of shape (n_frames, `self.codelength`) of bits
+            Estimated error patterns.
+
+        l: array of shape (n_frames, `self.codelength`) of floats
+            Final log-likelihood ratios.
+
+        n_iter: array of `n_frames` integers
+            Number of BP rounds run on each frame.
+
+        ok: array of `n_frames` booleans
+            Whether H e = s for each frame.
+
+        """
+
+        if p is not None: self.set_channel(p=p)
+        syndromes = np.atleast_2d(syndromes).astype(int) % 2
+        assert syndromes.ndim == 2 and syndromes.shape[1] == self.nchecks_
+        if llrs is None:
+            assert self.channel_model == "BSC", (
+                "Default priors need a BSC channel; pass llrs")
+            llrs = self._llrs(np.zeros(syndromes.shape[:1] + (
+                        self.codelength,), dtype=int))
+        else:
+            llrs = np.array(llrs, dtype=float)
+            assert llrs.shape == (len(syndromes), self.codelength)
+        return self._decode_frames(llrs, max_iter, batch_size,
+                                   syndromes=syndromes)
+
+    def _decode_frames(self, llrs, max_iter, batch_size, syndromes=None):
+        """
+        Decodes the frames with given channel log-likelihood ratios (one per
+        row), in chunks (see `decode_batch` and `decode_syndromes`).
+
+        """
+
+        n_frames = len(llrs)
+        if batch_size is None:
+            batch_size = max(1, 2 ** 16 // max(self.nedges_, 1))
+        x = (llrs < 0. if syndromes is not None else llrs <= 0.).astype(int)
+        l = llrs.copy()
+        n_iter = np.zeros(n_frames, dtype=int)
+        ok = np.zeros(n_frames, dtype=bool)
+        self._start_trace()
+        for start in xrange(0, n_frames, batch_size):
+            chunk = slice(start, start + batch_size)
+            self._decode_chunk(
+                llrs[chunk], max_iter, x[chunk], l[chunk], n_iter[chunk],
+                ok[chunk], None if syndromes is None else syndromes[chunk])
+        self._stop_trace()
+
+        return x, l, n_iter, ok
+
+    def _decode_chunk(self, llrs, max_iter, x, l, n_iter, ok,
+                      syndromes=None):
+        """
+        BP on a chunk of frames (see `decode_batch`). The results are
+        written into x, l, n_iter and ok.
+
+        """
+
+        # frames are laid out column-wise, see `_var_sums`
+        frames = dict(llrs=self._buf("llrs0", llrs.shape[::-1]), side=0)
+        frames["llrs"][...] = llrs.T
+        if syndromes is not None:
+            target = frames["target"] = self._buf(
+                "target0", syndromes.shape[::-1])
+            target[...] = syndromes.T
+            signs = frames["signs"] = np.take(
+                target, self.edge_checks_, axis=0, mode="clip",
+                out=self._buf("signs0", (self.nedges_, len(llrs))))
+            signs *= -2.
+            signs += 1.
+        active = np.arange(len(llrs))  # frames still being decoded
+        state = self._init_state(frames["llrs"])
+        tracing, tic = self._tracing(), time.time()
+        for it in xrange(max_iter):
+            if not len(active): break
+
+            c2v_old = state["c2v"]
+            l_, state, stalled = self._round(frames["llrs"], state,
+                                             frames.get("signs"))
+            decide = np.less_equal if syndromes is None else np.less
+            x_ = decide(l_, 0., out=self._buf("x", l_.shape, int))
+            l[active], x[active], n_iter[active] = l_.T, x_.T, it + 1
+
+            # test for convergence, frame by frame
+            syndrome = self._syndrome(x_)
+            if syndromes is not None:
+                syndrome = np.not_equal(syndrome, frames["target"], out=(
+                        self._buf("mismatch", syndrome.shape, bool)))
+            if tracing:
+                self._trace_round(it, tic, l_, syndrome, c2v_old,
+                                  state["c2v"])
+            ok_ = ~syndrome.any(axis=0)
+            ok[active] = ok_
+
+            # retire frames which converged or reached steady-state
+            keep = ~(ok_ | stalled)
+            if not keep.all():
+                active = active[keep]
+                state = self._compact(state, keep)
+                frames = self._compact(frames, keep)
+
+    def apply_bsc(self, codeword, rng=None):
+        """
+        Sends a codeword through the BSC: each bit is flipped with
+        probability p, drawing from rng (a RandomState or a seed, see
+        `core.check_rng`).
+
+        """
+
         assert len(codeword) == self.codelength
         assert self.channel_model == "BSC"
         assert self.is_codeword(codeword)
-        return (np.array(codeword, dtype=int) + (np.random.rand(
+        return (np.array(codeword, dtype=int) + (check_rng(rng).rand(
                     self.codelength) < self.p)) % 2
 
 
@@ -290,7 +1233,7 @@ def demo_1():
     p = .49
     checks = [[0, 1, 2], [0, 3, 4], [0, 5, 6]]
     obs = [1, 0, 0, 0, 0, 1, 0]
-    bp = LdpcBpDecoder(codelength, checks, p=p).fit(obs)
+    bp = LdpcBpDecoder(codelength, checks, p=p, verbose=1).fit(obs)
     return bp
 
 
@@ -305,7 +1248,7 @@ def demo_2():
     p = .2
     checks = [[0, 1, 3], [1, 2, 4], [0, 4, 5], [2, 3, 5]]
     obs = [1, 0, 1, 0, 1, 1]
-    return LdpcBpDecoder(codelength, checks, p=p).fit(obs)
+    return LdpcBpDecoder(codelength, checks, p=p, verbose=1).fit(obs)
 
 
 def demo_3():
@@ -319,7 +1262,7 @@ def demo_3():
     snr = 1.25
     checks = [[0, 1, 3], [1, 2, 4], [0, 4, 5], [2, 3, 5]]
     obs = [-.1, .5, -.8, 1., -.7, .5]
-    return LdpcBpDecoder(codelength, checks, snr=snr).fit(obs)
+    return LdpcBpDecoder(codelength, checks, snr=snr, verbose=1).fit(obs)
 
 
 def demo_4():
@@ -327,9 +1270,10 @@ def demo_4():
     checks = [[0, 1, 2, 3], [2, 3, 5], [0, 3, 4]]
     p = .1
     obs = [1, 1, 1, 0, 0, 0]
-    return LdpcBpDecoder(codelength, checks, p=p).fit(obs)
+    return LdpcBpDecoder(codelength, checks, p=p, verbose=1).fit(obs)
 
 if __name__ == "__main__":
+    import networkx as nx
     pl.close("all")
     for x in xrange(1, 5):
         demo = "demo_%i" % x
@@ -4,27 +4,59 @@
 
 """
 
-from functools import partial
-from random import shuffle
 import numpy as np
+import scipy.sparse as sp
 import pylab as pl
-import networkx as nx
-from codes import parmat2graph, rotate_list
+from codes import parmat2graph, check_rng
+from gf2 import css_code_parameters
+import quasi_cyclic
 
 
-def kl_div(p, q):
+def _removal_terms(h, S, rows):
     """
-    Kullback-Leibler divergence of q from p.
+    For each of the given rows of h, the number of columns which would
+    become empty, and the change in the sum of the logs of the (non-zero)
+    column weights, if the row were removed. S holds the current column
+    weights.
 
     """
 
-    msk = (p > 0) * (q > 0)
-    p = p[msk]
-    q = q[msk]
-    p = p / (1. * p.sum())
-    q = q / (1. * q.sum())
+    starts, ends = h.indptr[rows], h.indptr[rows + 1]
+    lengths = ends - starts
+    labels = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    s = S[h.indices[offsets + np.arange(lengths.sum())]]
+    drops = np.bincount(labels, weights=(s == 1), minlength=len(rows))
+    dlogs = np.bincount(labels, weights=np.log(np.maximum(
+                s - 1., 1.)) - np.log(s), minlength=len(rows))
+    return drops, dlogs
 
-    return np.sum(p * np.log(p / q))
+
+def _removal_scores(weights, drops, dlogs, M, T, L):
+    """
+    KL divergence of the normalized column weights from the uniform
+    distribution on the non-empty columns (sum of u log(u / w) for u = 1 /
+    M), after removing each row. With M non-empty columns, total weight T
+    and sum of log-weights L, this is log T - log M - L / M; `weights` are
+    the row weights.
+
+    """
+
+    M_ = M - drops
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scores = np.log(T - weights) - np.log(M_) - (L + dlogs) / M_
+    scores[~np.isfinite(scores)] = np.inf
+    return scores
+
+
+def _column_stats(S):
+    # number of non-empty columns, total weight, sum of log-weights
+    return np.count_nonzero(S), S.sum(), np.log(S[S > 0]).sum()
+
+
+def _argmin(scores, tol=1e-12):
+    # first of the (numerically) tied minima
+    return np.nonzero(scores <= scores.min() + tol)[0][0]
 
 
 def best_row_to_rm(h):
@@ -33,46 +65,97 @@ def best_row_to_rm(h):
 
     """
 
-    best = 1
-    best_core = np.inf
-    uniform = np.ones(h.shape[1])
-    for r in xrange(h.shape[0]):
-        score = kl_div(uniform, np.delete(h, r, axis=0).sum(axis=0))
-        if score < best_core:
-            best = r
-            best_core = score
+    h = sp.csr_matrix(h)
+    S = np.asarray(h.sum(axis=0), dtype=float).ravel()
+    drops, dlogs = _removal_terms(h, S, np.arange(h.shape[0]))
+    return _argmin(_removal_scores(np.diff(h.indptr), drops, dlogs,
+                                   *_column_stats(S)))
+
+
+def remove_rows(h, n_rows):
+    """
+    Greedily removes rows of h, one at a time, each time the row which does
+    least damage to the uniformity of column weights (see `best_row_to_rm`).
+
+    The column weights are updated incrementally, and so is the score of
+    each row: removing a row only changes the score terms of the rows
+    sharing a column with it.
+
+    Returns
+    -------
+    keep: array of `h.shape[0]` booleans
+        Mask of the rows which are kept.
 
-    return best
+    """
+
+    h = sp.csr_matrix(h)
+    h.sort_indices()
+    by_cols = h.tocsc()
+    S = np.asarray(h.sum(axis=0), dtype=float).ravel()
+    M, T, L = _column_stats(S)
+    weights = np.diff(h.indptr)
+    drops, dlogs = _removal_terms(h, S, np.arange(h.shape[0]))
+    keep = np.ones(h.shape[0], dtype=bool)
+    for _ in xrange(n_rows):
+        scores = _removal_scores(weights, drops, dlogs, M, T, L)
+        scores[~keep] = np.inf
+        r = _argmin(scores)
+        keep[r] = False
+        M, T, L = M - drops[r], T - weights[r], L + dlogs[r]
+        cols = h.indices[h.indptr[r]:h.indptr[r + 1]]
+        S[cols] -= 1.
+
+        # rescore the remaining rows which share a column with row r (none,
+        # if r is an all-zero row)
+        neighbors = np.unique(np.concatenate([by_cols.indices[
+                        by_cols.indptr[c]:by_cols.indptr[c + 1]]
+                                              for c in cols] + [
+                    np.zeros(0, dtype=by_cols.indices.dtype)]))
+        neighbors = neighbors[keep[neighbors]]
+        drops[neighbors], dlogs[neighbors] = _removal_terms(h, S, neighbors)
+
+    return keep
+
+
+def circulant(n, k, dense=False, rng=None):
+    """
+    Random n x n circulant matrix with row weight k: each row is the
+    previous one, rotated one place to the right. Returned in quasi-cyclic
+    form (see `quasi_cyclic.circulant`), unless `dense` is set.
 
+    The support of the first row is drawn from rng (a RandomState or a
+    seed, see `core.check_rng`).
+
+    """
 
-def circulant(n, k):
     assert k <= n
-    c = np.ndarray((n, n), dtype=int)
-    row = np.zeros(n)
-    row[:k] = 1
-    shuffle(row)
-    for r in xrange(n):
-        c[r] = row
-        row = rotate_list(list(row))
+    support = np.sort(check_rng(rng).permutation(n)[:k])
+    c = quasi_cyclic.circulant(support, n)
+    return c.toarray() if dense else c
 
-    return c
 
+def bicycle(m, n, k, dense=False, rng=None):
+    """
+    Mackay's bicycle code: H0 = [C, C^T] for a random (n / 2) x (n / 2)
+    circulant matrix C of row weight k / 2, from which rows are removed
+    until m are left, keeping the column weights as uniform as possible.
+    Returned in CSR format, unless `dense` is set. C is drawn from rng (see
+    `circulant`).
+
+    """
 
-def bicycle(m, n, k):
     assert n % 2 == k % 2 == 0, "n and k must be even!"
     a, b = n // 2, k // 2
-    c = circulant(a, b)
-    h0 = np.hstack((c, c.T))
+    c = circulant(a, b, rng=rng)
+    h0 = quasi_cyclic.hstack((c, c.T)).tocsr()
 
     # remove n / 2 - m rows, making sure column density remains uniform
-    if a > m:
-        for _ in xrange(a - m):
-            h0 = np.delete(h0, best_row_to_rm(h0), axis=0)
+    if a > m: h0 = h0[np.nonzero(remove_rows(h0, a - m))[0]]
 
     # rm isolated nodes
-    h0 = h0[:, (h0.sum(axis=0) > 0)]
+    h0 = h0[:, np.nonzero(np.asarray(h0.sum(axis=0)).ravel() > 0)[0]]
 
-    return h0
+    return h0.toarray() if dense else h0
 
 
 def mackay_monte_carlo_example():
@@ -80,9 +163,11 @@ def mackay_monte_carlo_example():
 
 
 if __name__ == '__main__':
+    import networkx as nx
     n, m, k = mackay_monte_carlo_example()
-    h = bicycle(m, n, k)
+    h = bicycle(m, n, k, dense=True)
     graph = parmat2graph(h)[0]
+    print "Bicycle code: [n, k] = [%i, %i]" % css_code_parameters(h, h)
 
     pl.close("all")
     pl.figure()
@@ -0,0 +1,365 @@
+"""
+:Synopsis: Monte-Carlo estimation of frame / bit error rates of LDPC codes
+under BP decoding, as a function of the channel parameter.
+:Author: DOHMATOB Elvis Dopgima <gmdopp@gmail.com> <elvis.dohmatob.inia.fr>
+
+Since the codes are linear and the channels are symmetric, the all-zero
+codeword is sent. Each point of the sweep is simulated in shards of frames;
+shard s of point i draws its noise from its own RandomState seeded with
+(seed, i, s), so that results are reproducible and independent of the number
+of worker processes.
+
+`css_error_rates` does the same for the logical error rates of quantum CSS
+codes under depolarizing noise, decoded from their syndromes.
+
+"""
+
+import os
+import json
+import hashlib
+import multiprocessing
+import numpy as np
+import scipy.sparse as sp
+from ldpc_bp import LdpcBpDecoder, compile_code
+from codes import parmat2checks, is_parmat
+from qldpc_bp import CssBpDecoder, depolarizing_errors
+
+# per-process state of the workers (see `_init_worker`)
+_worker = {}
+
+
+def wilson_interval(k, n, z=1.96):
+    """
+    Wilson score confidence interval for a binomial proportion k / n.
+
+    """
+
+    if n == 0: return 0., 1.
+    p = 1. * k / n
+    center = (p + z ** 2 / (2. * n)) / (1. + z ** 2 / n)
+    half = z * np.sqrt(p * (1. - p) / n + z ** 2 / (4. * n ** 2)) / (
+        1. + z ** 2 / n)
+    return max(center - half, 0.), min(center + half, 1.)
+
+
+def sample_channel(rng, n_frames, codelength, channel_model, level):
+    """
+    Channel outputs for the all-zero codeword, one frame per row.
+
+    For 'BSC', level is the crossover probability p. For 'AWGN', level is
+    the SNR and the codeword is sent as +1s (BPSK), with noise variance
+    1 / (2 * snr), consistently with `LdpcBpDecoder.compute_llr`.
+
+    """
+
+    if channel_model == "BSC":
+        return (rng.rand(n_frames, codelength) < level).astype(int)
+    else:
+        return 1. + rng.randn(n_frames, codelength) / np.sqrt(2. * level)
+
+
+def _init_worker(codelength, checks, channel_model, max_iter, schedule):
+    # the code is compiled once per worker, and its decoder is reused across
+    # levels (only the channel parameter changes)
+    _worker.clear()
+    _worker.update(plan=compile_code(checks, codelength=codelength),
+                   channel_model=channel_model, max_iter=max_iter,
+                   schedule=schedule, decoder=None)
+
+
+def _run_shard(task):
+    """
+    Simulates one shard of frames. Returns (frames, frame errors, bit errors,
+    total number of BP rounds).
+
+    """
+
+    level, n_frames, seed = task
+    plan, channel_model = _worker["plan"], _worker["channel_model"]
+    kwargs = {"p" if channel_model == "BSC" else "snr": level}
+    if _worker["decoder"] is None:
+        _worker["decoder"] = LdpcBpDecoder(
+            plan.codelength, plan, channel_model=channel_model,
+            schedule=_worker["schedule"], verbose=0, **kwargs)
+    decoder = _worker["decoder"]
+
+    rng = np.random.RandomState(seed)
+    obs = sample_channel(rng, n_frames, plan.codelength, channel_model,
+                         level)
+    x, _, n_iter, _ = decoder.decode_batch(obs, max_iter=_worker["max_iter"],
+                                           **kwargs)
+    bit_errors = x.sum(axis=1)
+    return (n_frames, int((bit_errors > 0).sum()), int(bit_errors.sum()),
+            int(n_iter.sum()))
+
+
+def _code_digest(*codes):
+    # SHA-1 of the supports of the checks of the codes (sorted within each
+    # check), so that a checkpoint isn't resumed with another code of the
+    # same shape
+    sha1 = hashlib.sha1()
+    for checks in codes:
+        sha1.update(json.dumps([sorted(map(int, check)) for check in checks]))
+    return sha1.hexdigest()
+
+
+def _load_checkpoint(checkpoint, config):
+    if checkpoint is None or not os.path.exists(checkpoint): return None
+    with open(checkpoint) as fd: state = json.load(fd)
+    assert state["config"] == config, (
+        "Checkpoint %s was written for another sweep" % checkpoint)
+    return state
+
+
+def _save_checkpoint(checkpoint, state):
+    if checkpoint is None: return
+    tmp = checkpoint + ".tmp"
+    with open(tmp, "w") as fd: json.dump(state, fd)
+    os.rename(tmp, checkpoint)  # atomic: never leaves a truncated file
+
+
+def _sweep(run_shard, init_worker, initargs, levels, config, counters,
+           max_failures, max_frames, shard_size, seed, n_jobs, checkpoint,
+           verbose, label, metric):
+    """
+    Simulates shards of frames at each level, until enough failures or
+    frames have been seen. Returns the per-level counters (dicts).
+
+    `run_shard` maps a task (level, n_frames, seed) to a tuple of counts,
+    named by `counters`, the first two of which are the number of frames
+    and of failures. Progress is printed as "<label> <level>: <metric> =
+    <failures> / <frames>".
+
+    """
+
+    state = _load_checkpoint(checkpoint, config)
+    if state is None:
+        state = dict(config=config, points=[dict(
+                    [("shards", 0), ("done", False)] + [
+                        (key, 0) for key in counters]) for _ in levels])
+
+    if n_jobs == 1:
+        init_worker(*initargs)
+        pool, mapper = None, map
+    else:
+        pool = multiprocessing.Pool(n_jobs, initializer=init_worker,
+                                    initargs=initargs)
+        mapper = pool.map
+    try:
+        for i, level in enumerate(levels):
+            point = state["points"][i]
+            while not point["done"]:
+                # a round of shards, accounted for in shard order so that
+                # the result does not depend on n_jobs
+                tasks = [(level, shard_size, [seed, i, point["shards"] + s])
+                         for s in xrange(max(n_jobs, 1))]
+                for res in mapper(run_shard, tasks):
+                    point["shards"] += 1
+                    for key, val in zip(counters, res):
+                        point[key] += val
+                    if point[counters[1]] >= max_failures or (
+                            point[counters[0]] >= max_frames):
+                        point["done"] = True
+                        break
+                _save_checkpoint(checkpoint, state)
+            if verbose:
+                print "%s %g: %s = %i / %i" % (label, level, metric,
+                                               point[counters[1]],
+                                               point[counters[0]])
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    return state["points"]
+
+
+def error_rates(checks, levels, channel_model="BSC", codelength=None,
+                max_failures=100, max_frames=100000, shard_size=1000,
+                max_iter=100, schedule="flooding", seed=0, n_jobs=1,
+                checkpoint=None, verbose=1):
+    """
+    Frame and bit error rates of BP decoding, over a grid of channel
+    parameters.
+
+    Parameters
+    ----------
+    checks: list of lists of integers, or parity-check matrix
+        The code (see `LdpcBpDecoder`).
+
+    levels: list of floats
+        Channel parameters: crossover probabilities p for 'BSC', SNRs for
+        'AWGN'.
+
+    channel_model: string, optional (default "BSC")
+        'BSC' or 'AWGN'.
+
+    codelength: int, optional (default None)
+        Length of the code. Inferred from checks if None.
+
+    max_failures: int, optional (default 100)
+        A point is done once this many frame errors have been seen...
+
+    max_frames: int, optional (default 100000)
+        ... or once this many frames have been simulated.
+
+    shard_size: int, optional (default 1000)
+        Number of frames per unit of work.
+
+    max_iter: int, optional (default 100)
+        Maximum number of BP rounds per frame.
+
+    schedule: string, optional (default "flooding")
+        BP schedule (see `LdpcBpDecoder`). Compare the 'mean_iter' of the
+        results across schedules to benchmark their convergence.
+
+    seed: int, optional (default 0)
+        Root seed of the noise streams.
+
+    n_jobs: int, optional (default 1)
+        Number of worker processes.
+
+    checkpoint: string, optional (default None)
+        Path of a JSON file where partial results are saved after every
+        round of shards. If it exists, the sweep resumes from it; it must
+        then have been written for the same code (as identified by a digest
+        of its checks) and parameters.
+
+    Returns
+    -------
+    results: dict of arrays, one entry per level
+        With keys 'levels', 'frames', 'frame_errors', 'bit_errors', 'fer',
+        'fer_ci', 'ber', 'ber_ci' (95% Wilson intervals) and 'mean_iter'.
+
+    """
+
+    channel_model = channel_model.upper()
+    assert channel_model in ["BSC", "AWGN"]
+    if is_parmat(checks, codelength):
+        codelength = checks.shape[1]
+        checks = parmat2checks(checks)
+    checks = [list(map(int, check)) for check in checks]
+    if codelength is None: codelength = 1 + max(map(max, checks))
+    levels = list(map(float, levels))
+    config = dict(levels=levels, channel_model=channel_model, seed=seed,
+                  codelength=codelength, shard_size=shard_size,
+                  max_iter=max_iter, schedule=schedule, nchecks=len(checks),
+                  code=_code_digest(checks))
+
+    points = _sweep(
+        _run_shard, _init_worker,
+        (codelength, checks, channel_model, max_iter, schedule), levels,
+        config, ["frames", "frame_errors", "bit_errors", "iters"],
+        max_failures, max_frames, shard_size, seed, n_jobs, checkpoint,
+        verbose, "p" if channel_model == "BSC" else "snr", "FER")
+
+    frames = np.array([pt["frames"] for pt in points])
+    frame_errors = np.array([pt["frame_errors"] for pt in points])
+    bit_errors = np.array([pt["bit_errors"] for pt in points])
+    bits = frames * codelength
+    return dict(
+        levels=np.array(levels), frames=frames, frame_errors=frame_errors,
+        bit_errors=bit_errors,
+        fer=frame_errors / np.maximum(frames, 1.),
+        fer_ci=np.array([wilson_interval(k, n)
+                         for k, n in zip(frame_errors, frames)]),
+        ber=bit_errors / np.maximum(bits, 1.),
+        ber_ci=np.array([wilson_interval(k, n)
+                         for k, n in zip(bit_errors, bits)]),
+        mean_iter=np.array([pt["iters"] for pt in points]) / np.maximum(
+            frames, 1.))
+
+
+def _init_css_worker(hx, hz, decoder_params):
+    _worker.clear()
+    _worker.update(decoder=CssBpDecoder(hx, hz, .01, **decoder_params))
+
+
+def _run_css_shard(task):
+    """
+    Simulates one shard of frames under depolarizing noise. Returns (frames,
+    logical errors, BP failures, total number of BP rounds).
+
+    """
+
+    level, n_frames, seed = task
+    decoder = _worker["decoder"].set_noise(level)
+    rng = np.random.RandomState(seed)
+    ex, ez = depolarizing_errors(rng, n_frames, decoder.n, level)
+    ex_hat, ez_hat = decoder.decode(decoder.hx.dot(ez.T).T % 2,
+                                    decoder.hz.dot(ex.T).T % 2)
+    failures = decoder.logical_errors(ex, ez, ex_hat, ez_hat)
+    return (n_frames, int(failures.sum()), int((~decoder.bp_ok_).sum()),
+            int(decoder.n_iter_.sum()))
+
+
+def css_error_rates(hx, hz, levels, mode="separate", osd_order=0,
+                    max_failures=100, max_frames=100000, shard_size=1000,
+                    max_iter=30, schedule="flooding", seed=0, n_jobs=1,
+                    checkpoint=None, verbose=1):
+    """
+    Logical error rates of BP + OSD decoding of a CSS code, over a grid of
+    depolarizing rates (e.g to locate the threshold of a family of toric or
+    bicycle codes). Sharding, seeding and checkpointing are as in
+    `error_rates`.
+
+    Parameters
+    ----------
+    hx, hz: 2D array-likes or scipy.sparse matrices
+        X and Z checks of the code (see `qldpc_bp.CssBpDecoder`).
+
+    levels: list of floats
+        Depolarizing rates.
+
+    mode, osd_order, max_iter, schedule:
+        Decoder parameters (see `qldpc_bp.CssBpDecoder`).
+
+    Other parameters: see `error_rates`.
+
+    Returns
+    -------
+    results: dict of arrays, one entry per level
+        With keys 'levels', 'frames', 'frame_errors' (logical errors),
+        'fer' (logical error rate), 'fer_ci' (95% Wilson interval),
+        'bp_failures' (frames on which BP alone did not match the
+        syndromes) and 'mean_iter' (BP rounds per frame, X and Z parts
+        included).
+
+    """
+
+    hx, hz = sp.csr_matrix(hx, dtype=int), sp.csr_matrix(hz, dtype=int)
+    levels = list(map(float, levels))
+    decoder_params = dict(mode=mode, osd_order=osd_order, max_iter=max_iter,
+                          schedule=schedule)
+    config = dict(levels=levels, seed=seed, shard_size=shard_size,
+                  n=hx.shape[1], nx=hx.shape[0], nz=hz.shape[0],
+                  code=_code_digest(parmat2checks(hx), parmat2checks(hz)),
+                  **decoder_params)
+
+    points = _sweep(
+        _run_css_shard, _init_css_worker, (hx, hz, decoder_params), levels,
+        config, ["frames", "frame_errors", "bp_failures", "iters"],
+        max_failures, max_frames, shard_size, seed, n_jobs, checkpoint,
+        verbose, "p", "LER")
+
+    frames = np.array([pt["frames"] for pt in points])
+    frame_errors = np.array([pt["frame_errors"] for pt in points])
+    return dict(
+        levels=np.array(levels), frames=frames, frame_errors=frame_errors,
+        fer=frame_errors / np.maximum(frames, 1.),
+        fer_ci=np.array([wilson_interval(k, n)
+                         for k, n in zip(frame_errors, frames)]),
+        bp_failures=np.array([pt["bp_failures"] for pt in points]),
+        mean_iter=np.array([pt["iters"] for pt in points]) / np.maximum(
+            frames, 1.))
+
+
+if __name__ == "__main__":
+    from mackay_qldpc import bicycle
+    h = bicycle(64, 256, 10)
+    res = error_rates(h, [.01, .02, .04, .06], n_jobs=4, max_failures=50,
+                      max_frames=20000)
+    for level, fer, ci, ber in zip(res["levels"], res["fer"], res["fer_ci"],
+                                   res["ber"]):
+        print "p = %.3f: FER = %.2e [%.2e, %.2e], BER = %.2e" % (
+            level, fer, ci[0], ci[1], ber)
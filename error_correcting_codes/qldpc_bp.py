@@ -0,0 +1,353 @@
+"""
+:Synopsis: Syndrome-based BP decoding of quantum CSS codes, with OSD
+post-processing.
+:Author: DOHMATOB Elvis Dopgima <gmdopp@gmail.com> <elvis.dohmatob.inia.fr>
+
+A CSS code has X checks HX and Z checks HZ, with HX HZ^T = 0 (mod 2). An error
+X^ex Z^ez on the qubits is only seen through its syndromes sx = HX ez and
+sz = HZ ex (mod 2): the X part of the error is decoded from the Z syndrome,
+and the Z part from the X syndrome, with the syndrome mode of `LdpcBpDecoder`
+(see `LdpcBpDecoder.decode_syndromes`).
+
+Under depolarizing noise of rate p, each qubit suffers an X, a Y = XZ or a Z
+error, each with probability p / 3, so that the X and Z parts of the errors
+are both flipped with probability 2p / 3, but are correlated.
+
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.special import expit
+from ldpc_bp import LdpcBpDecoder, compile_code, hypercube
+import gf2
+
+
+def depolarizing_errors(rng, n_frames, n, p):
+    """
+    Samples depolarizing errors of rate p on n qubits.
+
+    Returns
+    -------
+    ex, ez: arrays of shape (n_frames, n) of bits
+        X and Z parts of the errors.
+
+    """
+
+    u = rng.rand(n_frames, n)
+    ex = (u < 2. * p / 3.).astype(np.uint8)  # X or Y
+    ez = ((u >= p / 3.) & (u < p)).astype(np.uint8)  # Y or Z
+    return ex, ez
+
+
+def osd(h, syndromes, l, weights=None, order=0):
+    """
+    Ordered statistics decoding (OSD), as a post-processing of BP [1].
+
+    For each frame, the bits are sorted by decreasing BP posterior
+    probability of error (i.e by increasing LLR), and the syndrome is solved
+    on the first linearly independent columns of h in that order (the
+    "information set"), all other bits being set to 0: this is OSD-0. With
+    order w > 0, all the 2^w settings of the w most probable non-pivot bits
+    are tried (exhaustive OSD-w), and the lightest solution is kept.
+
+    h stays sparse: for each frame, its columns are permuted in the
+    frame's order and packed into uint64 words, together with the syndrome
+    as an extra last column, and the elimination is done by
+    `gf2.row_echelon`, with XORs of packed rows.
+
+    Parameters
+    ----------
+    h: 2D array-like or scipy.sparse matrix of shape (m, n)
+        Parity-check matrix.
+
+    syndromes: 2D array of shape (n_frames, m)
+        Syndromes, one per row.
+
+    l: 2D array of shape (n_frames, n)
+        Posterior log-likelihood ratios computed by BP.
+
+    weights: array of shape (n_frames, n) or (n,), optional (default None)
+        Cost of each bit being in error, typically the prior log-likelihood
+        ratios log((1 - p) / p). Defaults to 1 (Hamming weight).
+
+    order: int, optional (default 0)
+        OSD order w. The cost grows like 2^w.
+
+    Returns
+    -------
+    e: array of shape (n_frames, n) of uint8
+        Error patterns.
+
+    ok: array of `n_frames` booleans
+        Whether each syndrome could be reproduced (i.e was consistent).
+
+    References
+    ----------
+    [1] P. Panteleev and G. Kalachev, "Degenerate quantum LDPC codes with
+        good finite length performance", Quantum 5, 585 (2021)
+
+    """
+
+    h = sp.coo_matrix(h)
+    odd = (h.data.astype(int) % 2) == 1
+    rows, cols = h.row[odd], h.col[odd]
+    syndromes = np.atleast_2d(syndromes).astype(np.uint8) % 2
+    l = np.atleast_2d(l)
+    n_frames, n = l.shape
+    m = h.shape[0]
+    if weights is None: weights = np.ones(n)
+    weights = np.broadcast_to(weights, (n_frames, n))
+    settings = lambda k: np.array(list(hypercube(k)), dtype=np.uint8).reshape(
+        (1 << k, k))  # all the 2^k settings of k bits
+    trials = settings(order)
+
+    e = np.zeros((n_frames, n), dtype=np.uint8)
+    ok = np.zeros(n_frames, dtype=bool)
+    for f in xrange(n_frames):
+        # [H | s], columns in the order of the frame
+        perm = np.argsort(l[f], kind="mergesort")
+        position = np.empty(n, dtype=int)
+        position[perm] = np.arange(n)
+        hit = np.nonzero(syndromes[f])[0]
+        aug = sp.coo_matrix((np.ones(len(rows) + len(hit), dtype=int), (
+                    np.concatenate((rows, hit)), np.concatenate((
+                            position[cols], np.repeat(n, len(hit)))))),
+                            shape=(m, n + 1))
+
+        # Gauss-Jordan elimination of the first n columns: the syndrome
+        # column is carried along, but never pivoted on
+        R, pivots = gf2.row_echelon((gf2.pack(aug)[0], n))
+        rank = len(pivots)
+        syn = _packed_columns(R, [n])[:, 0]
+        ok[f] = not syn[rank:].any()  # consistency
+        syn = syn[:rank]
+
+        # OSD-0: pivot bits are the (reduced) syndrome, non-pivot bits are 0
+        e_perm = np.zeros(n, dtype=np.uint8)
+        e_perm[pivots] = syn
+
+        if order:
+            # the `order` most probable non-pivot bits, and the costs of all
+            # the 2^order settings of them
+            free = np.setdiff1d(np.arange(n), pivots)[:order]
+            w = weights[f, perm]
+            R_free = _packed_columns(R[:rank], free)
+            t = trials if len(free) == order else settings(len(free))
+            solutions = (syn + t.dot(R_free.T)) % 2
+            costs = t.dot(w[free]) + solutions.dot(w[pivots])
+            best = costs.argmin()
+            e_perm[pivots] = solutions[best]
+            e_perm[free] = t[best]
+
+        e[f, perm] = e_perm
+    return e, ok
+
+
+def _packed_columns(packed, cols):
+    """
+    Columns of a packed matrix (see `gf2.pack`), as a 0/1 uint8 matrix.
+
+    """
+
+    cols = np.asarray(cols, dtype=int)
+    return ((packed[:, cols // gf2.WORD] >> (cols % gf2.WORD).astype(
+                np.uint64)) & np.uint64(1)).astype(np.uint8)
+
+
+class CssBpDecoder(object):
+    """
+    Syndrome-based BP + OSD decoder for CSS codes, under depolarizing noise.
+
+    Parameters
+    ----------
+    hx, hz: 2D array-likes or scipy.sparse matrices
+        Parity-check matrices of the X and Z checks (e.g as returned by
+        `codes.kovalev_toric_code_construction(d, split=True)` or
+        `codes.tanner_cartesian_product(h1, h2, split=True)`). For a
+        classical parity-check matrix h such as `mackay_qldpc.bicycle`,
+        whose rows are mutually orthogonal, use hx = hz = h.
+
+    p: float in the open interval (0, 3 / 4)
+        Depolarizing rate.
+
+    mode: string, optional (default "separate")
+        Possible values are:
+        'separate': the X and Z parts of the errors are decoded
+        independently, each with prior 2p / 3.
+        'joint': the correlations of depolarizing noise are used, by
+        decoding the X and Z parts alternately, the priors of one part
+        being updated from the posteriors of the other: a qubit whose Z part
+        is (probably) flipped has its X part flipped with probability 1 / 2
+        (a Y error), and with probability (p / 3) / (1 - 2p / 3) otherwise.
+
+    n_passes: int, optional (default 2)
+        Number of (X, Z) decoding passes, in 'joint' mode.
+
+    osd_order: int or None, optional (default 0)
+        Order of the OSD post-processing of the frames for which BP fails
+        (see `osd`). If None, no post-processing is done.
+
+    schedule: string, optional (default "flooding")
+        BP schedule (see `LdpcBpDecoder`).
+
+    max_iter: int, optional (default 30)
+        Maximum number of BP rounds per decoding. BP rarely converges on
+        degenerate codes such as the toric codes (OSD does most of the work
+        there), and more rounds seldom help.
+
+    batch_size: int, optional (default None)
+        See `LdpcBpDecoder.decode_batch`.
+
+    Attributes
+    ----------
+    x_decoder_, z_decoder_: `LdpcBpDecoder` objects
+        Syndrome decoders of the X part (on the Z checks) and of the Z part
+        (on the X checks) of the errors.
+
+    n_iter_: array of integers
+        Total number of BP rounds run on each frame by the last call to
+        `decode` (over both parts, and all passes).
+
+    bp_ok_: array of booleans
+        Whether BP alone reproduced both syndromes of each frame.
+
+    ok_: array of booleans
+        Whether the decoded errors reproduce both syndromes of each frame
+        (after OSD).
+
+    """
+
+    def __init__(self, hx, hz, p, mode="separate", n_passes=2, osd_order=0,
+                 schedule="flooding", max_iter=30, batch_size=None):
+        assert mode in ["separate", "joint"], "Unsupported mode: %s" % mode
+        self.hx = sp.csr_matrix(hx, dtype=np.uint8)
+        self.hz = sp.csr_matrix(hz, dtype=np.uint8)
+        assert self.hx.shape[1] == self.hz.shape[1]
+        self.n = self.hx.shape[1]
+        self.mode = mode
+        self.n_passes = n_passes
+        self.osd_order = osd_order
+        self.max_iter = max_iter
+        self.batch_size = batch_size
+
+        # the X part of an error is seen by the Z checks, and vice versa
+        self.set_noise(p)
+        self.x_decoder_ = LdpcBpDecoder(self.n, compile_code(
+                self.hz, self.n), p=self.q_, schedule=schedule)
+        self.z_decoder_ = LdpcBpDecoder(self.n, compile_code(
+                self.hx, self.n), p=self.q_, schedule=schedule)
+        self._echelons = {}
+
+    def set_noise(self, p):
+        """
+        (Re)sets the depolarizing rate (the codes are not recompiled).
+
+        """
+
+        assert 0 < p < .75, "p must be in the open interval (0, 3 / 4)"
+        self.p = p
+        self.q_ = 2. * p / 3.  # marginal rate of X (resp. Z) flips
+        for decoder in [getattr(self, "x_decoder_", None),
+                        getattr(self, "z_decoder_", None)]:
+            if decoder is not None: decoder.set_channel(p=self.q_)
+        return self
+
+    def _priors(self, n_frames, l_other=None):
+        """
+        Prior LLRs of the X (resp. Z) part of the errors, given the
+        posterior LLRs of the Z (resp. X) part if any.
+
+        """
+
+        if l_other is None:
+            return np.tile(np.log((1. - self.q_) / self.q_),
+                           (n_frames, self.n))
+        other = expit(-l_other)  # posterior probability of a flip
+        q = .5 * other + (1. - other) * (self.p / 3.) / (1. - self.q_)
+        return np.log((1. - q) / q)
+
+    def _decode_part(self, decoder, h, syndromes, llrs):
+        e, l, n_iter, ok = decoder.decode_syndromes(
+            syndromes, max_iter=self.max_iter, batch_size=self.batch_size,
+            llrs=llrs)
+        e = e.astype(np.uint8)
+        bp_ok = ok.copy()
+        if self.osd_order is not None and not ok.all():
+            e[~ok], ok[~ok] = osd(h, syndromes[~ok], l[~ok],
+                                  weights=llrs[~ok], order=self.osd_order)
+        return e, l, n_iter, bp_ok, ok
+
+    def decode(self, sx, sz):
+        """
+        Decodes a batch of syndromes.
+
+        Parameters
+        ----------
+        sx, sz: 2D arrays of shape (n_frames, number of X / Z checks)
+            Syndromes HX ez and HZ ex (mod 2), one frame per row.
+
+        Returns
+        -------
+        ex, ez: arrays of shape (n_frames, `self.n`) of uint8
+            X and Z parts of the decoded errors.
+
+        """
+
+        sx = np.atleast_2d(sx).astype(int) % 2
+        sz = np.atleast_2d(sz).astype(int) % 2
+        assert len(sx) == len(sz)
+        n_frames = len(sx)
+
+        lz = None
+        self.n_iter_ = np.zeros(n_frames, dtype=int)
+        for _ in xrange(self.n_passes if self.mode == "joint" else 1):
+            priors = self._priors(n_frames, lz if self.mode == "joint"
+                                  else None)
+            ex, lx, n_iter, bp_okx, okx = self._decode_part(
+                self.x_decoder_, self.hz, sz, priors)
+            self.n_iter_ += n_iter
+            priors = self._priors(n_frames, lx if self.mode == "joint"
+                                  else None)
+            ez, lz, n_iter, bp_okz, okz = self._decode_part(
+                self.z_decoder_, self.hx, sx, priors)
+            self.n_iter_ += n_iter
+
+        self.bp_ok_ = bp_okx & bp_okz
+        self.ok_ = okx & okz
+        return ex, ez
+
+    def logical_errors(self, ex, ez, ex_hat, ez_hat):
+        """
+        Whether the decoded errors differ from the actual ones by a logical
+        operator, i.e whether the residual X (resp. Z) error is not a product
+        of X (resp. Z) stabilizers (rows of HX, resp. HZ).
+
+        """
+
+        for key, h in [("x", self.hx), ("z", self.hz)]:
+            if key not in self._echelons:
+                self._echelons[key] = gf2.row_echelon(h)
+        rx = np.bitwise_xor(ex, ex_hat)
+        rz = np.bitwise_xor(ez, ez_hat)
+        return gf2.reduce_rows(self._echelons["x"], rx).any(axis=1) | (
+            gf2.reduce_rows(self._echelons["z"], rz).any(axis=1))
+
+
+if __name__ == "__main__":
+    import time
+    from codes import kovalev_toric_code_construction
+    rng = np.random.RandomState(42)
+    for d in [6, 8, 10]:
+        hx, hz = kovalev_toric_code_construction(d, split=True)
+        for mode in ["separate", "joint"]:
+            decoder = CssBpDecoder(hx, hz, .05, mode=mode)
+            for p in [.03, .06, .09, .12]:
+                tic = time.time()
+                decoder.set_noise(p)
+                ex, ez = depolarizing_errors(rng, 2000, decoder.n, p)
+                sx = hx.dot(ez.T).T % 2
+                sz = hz.dot(ex.T).T % 2
+                ex_hat, ez_hat = decoder.decode(sx, sz)
+                fails = decoder.logical_errors(ex, ez, ex_hat, ez_hat)
+                print "d = %2i, %8s, p = %.2f: LER = %.4f (%.1fs)" % (
+                    d, mode, p, fails.mean(), time.time() - tic)
@@ -0,0 +1,182 @@
+"""
+:Synopsis: Compact quasi-cyclic binary matrices, for code constructions.
+:Author: DOHMATOB Elvis Dopgima <gmdopp@gmail.com> <elvis.dohmatob.inia.fr>
+
+A quasi-cyclic matrix is a grid of b x b circulant blocks. A circulant block
+is a sum of shifted identities P^s (P^s has its ones at (r, (r + s) % b)),
+i.e it is given by the support of its first row. Only the triples (block
+row, block column, shift) are stored, so that e.g a bicycle or a Kovalev code
+takes O(weight) memory instead of O(weight * b).
+
+`QuasiCyclic` is a scipy.sparse matrix: it can be passed wherever a sparse
+parity-check matrix is expected (`codes.tanner_adjacency`,
+`ldpc_bp.compile_code`, `gf2`, ...), and is expanded to CSR on demand.
+
+"""
+
+import numpy as np
+import scipy.sparse as sp
+
+
+class QuasiCyclic(sp.spmatrix):
+    """
+    Binary quasi-cyclic matrix.
+
+    Parameters
+    ----------
+    block_row, block_col, shift: 1D arrays of integers
+        Block (block_row[t], block_col[t]) of the grid contains the shifted
+        identity P^shift[t]. Repeated triples cancel (mod 2); shifts are
+        taken modulo the block size.
+
+    grid: pair of integers
+        Number of block rows and block columns.
+
+    block_size: int
+        Size b of the (square) blocks.
+
+    """
+
+    format = "qc"
+
+    def __init__(self, block_row, block_col, shift, grid, block_size):
+        sp.spmatrix.__init__(self)
+        R, C = grid
+        b = block_size
+        keys = (np.asarray(block_row, dtype=int) * C + np.asarray(
+                block_col, dtype=int)) * b + np.asarray(shift, dtype=int) % b
+        keys, counts = np.unique(keys, return_counts=True)
+        keys = keys[counts % 2 == 1]
+        self.block_row, self.block_col = np.divmod(keys // b, C)
+        self.shift = keys % b
+        self.grid = (R, C)
+        self.block_size = b
+        self.dtype = np.dtype(int)
+        self._shape = (R * b, C * b)
+
+    def __repr__(self):
+        return ("<%dx%d quasi-cyclic matrix with %dx%d blocks of size %d, "
+                "and %d shifts>") % (self.shape + self.grid + (
+                self.block_size, len(self.shift)))
+
+    def getnnz(self, axis=None):
+        if axis is None: return len(self.shift) * self.block_size
+        return self.tocsr().getnnz(axis=axis)
+
+    def transpose(self, axes=None, copy=False):
+        # (P^s)^T = P^-s
+        return QuasiCyclic(self.block_col, self.block_row, -self.shift,
+                           self.grid[::-1], self.block_size)
+
+    def copy(self):
+        return QuasiCyclic(self.block_row, self.block_col, self.shift,
+                           self.grid, self.block_size)
+
+    def tocoo(self, copy=False):
+        b = self.block_size
+        r = np.arange(b)
+        rows = (self.block_row * b)[:, np.newaxis] + r
+        cols = (self.block_col * b)[:, np.newaxis] + (
+            r + self.shift[:, np.newaxis]) % b
+        return sp.coo_matrix((np.ones(rows.size, dtype=int), (
+                    rows.ravel(), cols.ravel())), shape=self.shape)
+
+    def tocsr(self, copy=False):
+        h = self.tocoo().tocsr()
+        h.sort_indices()
+        return h
+
+
+def circulant(support, b):
+    """
+    b x b circulant matrix with first row supported on `support`: row r is
+    supported on (support + r) % b.
+
+    """
+
+    support = np.asarray(support, dtype=int)
+    zeros = np.zeros(len(support), dtype=int)
+    return QuasiCyclic(zeros, zeros, support, (1, 1), b)
+
+
+def identity(n, b=None):
+    """
+    n x n identity matrix, as a diagonal of b x b blocks (b defaults to n,
+    and must divide n).
+
+    """
+
+    if b is None: b = n
+    assert n % b == 0, "block size %i doesn't divide %i" % (b, n)
+    diag = np.arange(n // b)
+    return QuasiCyclic(diag, diag, np.zeros_like(diag), (n // b, n // b), b)
+
+
+def _check_blocks(mats):
+    assert all(isinstance(mat, QuasiCyclic) for mat in mats)
+    b = mats[0].block_size
+    assert all(mat.block_size == b for mat in mats), (
+        "blocks sizes differ: %s" % [mat.block_size for mat in mats])
+    return b
+
+
+def hstack(mats):
+    """
+    Stacks quasi-cyclic matrices (with same block size) horizontally.
+
+    """
+
+    b = _check_blocks(mats)
+    R = mats[0].grid[0]
+    assert all(mat.grid[0] == R for mat in mats)
+    offsets = np.cumsum([0] + [mat.grid[1] for mat in mats])
+    return QuasiCyclic(
+        np.concatenate([mat.block_row for mat in mats]),
+        np.concatenate([mat.block_col + o for mat, o in zip(mats, offsets)]),
+        np.concatenate([mat.shift for mat in mats]), (R, offsets[-1]), b)
+
+
+def vstack(mats):
+    """
+    Stacks quasi-cyclic matrices (with same block size) vertically.
+
+    """
+
+    return hstack([mat.T for mat in mats]).T
+
+
+def block_diag(mats):
+    """
+    Block-diagonal matrix of quasi-cyclic matrices (with same block size).
+
+    """
+
+    b = _check_blocks(mats)
+    row_offsets = np.cumsum([0] + [mat.grid[0] for mat in mats])
+    col_offsets = np.cumsum([0] + [mat.grid[1] for mat in mats])
+    return QuasiCyclic(
+        np.concatenate([mat.block_row + o for mat, o in zip(
+                    mats, row_offsets)]),
+        np.concatenate([mat.block_col + o for mat, o in zip(
+                    mats, col_offsets)]),
+        np.concatenate([mat.shift for mat in mats]),
+        (row_offsets[-1], col_offsets[-1]), b)
+
+
+def kron(A, B):
+    """
+    Kronecker product A x B of a binary matrix A (dense, scipy.sparse or
+    quasi-cyclic) with a quasi-cyclic matrix B. The result is quasi-cyclic,
+    with the block size of B: block (i, j) of A x B is A[i, j] B.
+
+    """
+
+    assert isinstance(B, QuasiCyclic)
+    A = sp.coo_matrix(A)
+    odd = (A.data.astype(int) % 2) == 1
+    i, j = A.row[odd][:, np.newaxis], A.col[odd][:, np.newaxis]
+    R, C = B.grid
+    return QuasiCyclic((i * R + B.block_row).ravel(),
+                       (j * C + B.block_col).ravel(),
+                       np.tile(B.shift, len(i)),
+                       (A.shape[0] * R, A.shape[1] * C), B.block_size)
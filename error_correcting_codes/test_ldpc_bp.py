@@ -0,0 +1,41 @@
+"""
+:Synopsis: Regression tests for the BP decoder of binary LDPC codes.
+:Author: DOHMATOB Elvis Dopgima <gmdopp@gmail.com> <elvis.dohmatob.inia.fr>
+
+"""
+
+import numpy as np
+import scipy.sparse as sp
+from ldpc_bp import LdpcBpDecoder
+
+# parity-check matrix of a [6, 3] code, with trailing (and inner) zero rows
+H = np.zeros((7, 6), dtype=int)
+for row, support in enumerate([[0, 1, 3], [1, 2, 4], [], [0, 2, 5],
+                               [3, 4, 5]]):
+    H[row, support] = 1
+
+
+def test_syndrome_with_empty_checks():
+    decoder = LdpcBpDecoder(5, [[0, 1, 2, 3, 4], []], p=.1)
+    assert not decoder.is_codeword([0, 0, 0, 0, 1])
+    assert decoder.is_codeword([1, 1, 0, 0, 0])
+
+
+def test_empty_checks_match_graph_engine():
+    for flip in xrange(6):
+        obs = np.zeros(6, dtype=int)
+        obs[flip] = 1
+        reference = LdpcBpDecoder(6, H, p=.1, engine="graph").fit(obs)
+        for h in [H, sp.csr_matrix(H)]:
+            for schedule in ["flooding", "layered", "residual"]:
+                decoder = LdpcBpDecoder(6, h, p=.1, schedule=schedule)
+                decoder.fit(obs)
+                np.testing.assert_array_equal(decoder.x_, reference.x_)
+                assert decoder.is_codeword(decoder.x_)
+
+
+def test_dense_supports_are_not_a_parity_check_matrix():
+    # Hamming(7, 4), as a 2D array of check supports
+    supports = np.array([[0, 1, 2, 4], [1, 2, 3, 5], [0, 2, 3, 6]])
+    for checks in [supports, supports.tolist()]:
+        assert LdpcBpDecoder(7, checks, p=.1).nedges_ == 12
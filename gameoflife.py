@@ -2,47 +2,76 @@
 :Synopsis: John Conway's Game of Life, Or yet another universal machine.
 :Author: DOHMATOB Elvis Dopgima <gmdopp@gmail.com> <elvis.dohmatob@inria.fr>
 
+Three engines are provided, all on the torus and all giving the same
+generations:
+
+- "naive": the cell-by-cell reference rules (`next_state`);
+- "swar": a bit-parallel one, in which the board is packed into uint64 words
+  (bit j % 64 of word j // 64 of a row is the cell in column j) and the
+  neighbour counts of 64 cells are computed at once, with bitwise adders
+  (`swar_step`);
+- "sparse": an active-tiles one, which only recomputes the tiles next to
+  those which changed at the previous generation (`SparseLife`).
+
+Besides stepping one generation at a time, `Life.jump` advances many
+generations at once with HashLife (see `hashlife`), on a periodic tiling of
+the board which emulates the torus.
+
+A game is run with a `Life` instance, which needs no terminal: rendering is
+optional (and rate-limited), so that batch jobs run at full compute speed.
+
 """
 
 import os
+import sys
 import time
 import itertools
 import numpy as np
 
 LIVE_CHR = "*"
 DEAD_CHR = " "
-SCREEN_HEIGHT, SCREEN_WIDTH = map(int, os.popen('stty size', 'r').read().split())
-BOARD = np.zeros((SCREEN_HEIGHT, SCREEN_WIDTH), dtype=np.uint8)
-NB_BOARD = np.zeros_like(BOARD)
+WORD = 64
+_ONE = np.uint64(1)
+
+
+def terminal_size(default=(24, 80)):
+    """
+    Size (rows, columns) of the terminal, or default if there's none.
+
+    """
+
+    size = os.popen('stty size 2> /dev/null', 'r').read().split()
+    return tuple(map(int, size)) if len(size) == 2 else default
+
 
 # checks if given cell is alive or dead.
-is_alive = lambda cell: BOARD[cell[0], cell[1]]
+is_alive = lambda board, cell: board[cell[0], cell[1]]
 
 # counts number of lively neighbors of given cell.
-count_neighbors_alive = lambda cell: len([n for n in get_neighbors(
-            cell) if is_alive(n)])
+count_neighbors_alive = lambda board, cell: len([n for n in get_neighbors(
+            cell, board.shape) if is_alive(board, n)])
 
 
-def get_neighbors(cell):
+def get_neighbors(cell, shape):
     """
-    Get (Voronoi) neighbors of given cell.
+    Get (Voronoi) neighbors of given cell, on a board of given shape.
 
     """
 
     x, y = cell
     for dx, dy in itertools.product([-1, 0, 1], [-1, 0, 1]):
-        if dx ** 2 + dy ** 2 > 0: yield ((x + dx) % BOARD.shape[0],
-                                         (y + dy) % BOARD.shape[1])
+        if dx ** 2 + dy ** 2 > 0: yield ((x + dx) % shape[0],
+                                         (y + dy) % shape[1])
 
 
-def next_state(cell):
+def next_state(board, cell):
     """
     Infer next state of given cell.
 
     """
 
-    count = count_neighbors_alive(cell)
-    if is_alive(cell):
+    count = count_neighbors_alive(board, cell)
+    if is_alive(board, cell):
         if count < 2: return 0  # die of loneliness
         elif count > 3: return 0  # death by over-population
         else: return 1  # just the right number of buddies to roll
@@ -51,53 +80,392 @@ def next_state(cell):
         else: return 0  # stay very dead
 
 
-def display():
+def naive_step(board):
+    """
+    Next generation of board, with the cell-by-cell rules.
+
+    """
+
+    backup = np.zeros_like(board)  # backup current state
+    for i in xrange(board.shape[0]):
+        for j in xrange(board.shape[1]):
+            backup[i, j] = next_state(board, (i, j))
+    return backup
+
+
+def pack_board(board):
+    """
+    Packs the rows of a 0/1 board into uint64 words.
+
+    Returns
+    -------
+    words: 2D array of uint64, of shape (height, ceil(width / 64))
+        The packed rows; the padding bits (past the width) are zero.
+
+    """
+
+    height, width = board.shape
+    nwords = (width + WORD - 1) // WORD
+    bits = np.zeros((height, nwords * WORD), dtype=np.uint64)
+    bits[:, :width] = board != 0
+    bits = bits.reshape((height, nwords, WORD)) << np.arange(
+        WORD, dtype=np.uint64)
+    return np.bitwise_or.reduce(bits, axis=2)
+
+
+def unpack_board(words, width):
+    """
+    Inverse of `pack_board`: returns the (uint8) board.
+
+    """
+
+    bits = (words[:, :, np.newaxis] >> np.arange(
+            WORD, dtype=np.uint64)) & _ONE
+    return bits.reshape((len(words), -1))[:, :width].astype(np.uint8)
+
+
+def _west_east(words, width):
+    """
+    Packed rows of the western and eastern neighbours of each cell (i.e the
+    rows rotated one cell to the right, resp. to the left), with toroidal
+    wrap at `width`. The padding bits are garbage.
+
+    """
+
+    last, pos = (width - 1) // WORD, np.uint64((width - 1) % WORD)
+
+    # bit j of west is cell j - 1: shift up, carrying bit 63 of the previous
+    # word, and wrap cell width - 1 around to cell 0
+    west = words << _ONE
+    west[:, 1:] |= words[:, :-1] >> np.uint64(WORD - 1)
+    west[:, 0] |= (words[:, last] >> pos) & _ONE
+
+    # bit j of east is cell j + 1: shift down, carrying bit 0 of the next
+    # word, and wrap cell 0 around to cell width - 1
+    east = words >> _ONE
+    east[:, :-1] |= words[:, 1:] << np.uint64(WORD - 1)
+    east[:, last] &= ~(_ONE << pos)
+    east[:, last] |= (words[:, 0] & _ONE) << pos
+    return west, east
+
+
+def swar_step(words, width):
+    """
+    Next generation of a packed board (see `pack_board`), on the torus.
+
+    The 8 neighbours of all cells are summed with full / half adders, 64
+    cells per bitwise operation: the rows above and below contribute 2-bit
+    sums of their 3 neighbours, the row itself a 2-bit sum of 2. A cell is
+    alive at the next generation iff its count is 3, or 2 and it's alive.
+
+    """
+
+    north = np.roll(words, 1, axis=0)
+    south = np.roll(words, -1, axis=0)
+    west, east = _west_east(words, width)
+    north_west, north_east = np.roll(west, 1, axis=0), np.roll(
+        east, 1, axis=0)
+    south_west, south_east = np.roll(west, -1, axis=0), np.roll(
+        east, -1, axis=0)
+
+    # 2-bit sums of the neighbours in each of the 3 rows
+    x = north_west ^ north
+    n0, n1 = x ^ north_east, (north_west & north) | (x & north_east)
+    m0, m1 = west ^ east, west & east
+    x = south_west ^ south
+    s0, s1 = x ^ south_east, (south_west & south) | (x & south_east)
+
+    # units (and carry) of the count, then whether exactly one of the twos
+    # is set, i.e the count is 2 or 3
+    x = n0 ^ m0
+    units, carry = x ^ s0, (n0 & m0) | (x & s0)
+    twos = (n1 ^ m1 ^ s1 ^ carry) & ~((n1 & m1) | (s1 & carry))
+
+    new = twos & (units | words)
+    if width % WORD: new[:, -1] &= (_ONE << np.uint64(width % WORD)) - _ONE
+    return new
+
+
+class SparseLife(object):
+    """
+    Game of Life on the torus, recomputing only the tiles which may change.
+
+    The board is cut into tiles; a tile is recomputed iff it, or one of its 8
+    neighbouring tiles, changed at the previous generation (other tiles
+    can't change). The active tiles are stepped all at once, each with its
+    1-cell halo, and written into the back one of two preallocated boards:
+    any other tile was unchanged at the previous generation, so it already
+    holds the same cells in both boards.
+
+    Parameters
+    ----------
+    board: 2D array of 0/1
+        Initial board (copied).
+
+    tile_shape: pair of integers, optional (default (16, 16))
+        Shape of the tiles. Tiles at the bottom / right border may wrap
+        around the board if they don't divide it.
+
+    Attributes
+    ----------
+    stats: list of pairs of integers
+        Numbers of recomputed and changed tiles, at each generation.
+
+    """
+
+    def __init__(self, board, tile_shape=(16, 16)):
+        board = np.asarray(board, dtype=np.uint8)
+        self.boards = [board.copy(), board.copy()]
+        self.front = 0
+        self.tile_shape = tile_shape
+        height, width = board.shape
+        th, tw = tile_shape
+        self.dirty = np.ones(((height + th - 1) // th,
+                              (width + tw - 1) // tw), dtype=bool)
+        self.stats = []
+
+    @property
+    def board(self):
+        return self.boards[self.front]
+
+    def step(self):
+        """
+        Advances the board one generation.
+
+        """
+
+        # tiles which changed, and their neighbours (on the torus of tiles)
+        active = self.dirty.copy()
+        for di, dj in itertools.product([-1, 0, 1], [-1, 0, 1]):
+            if di or dj: active |= np.roll(np.roll(self.dirty, di, axis=0),
+                                           dj, axis=1)
+        ti, tj = np.nonzero(active)
+        th, tw = self.tile_shape
+        height, width = self.board.shape
+        rows = (ti[:, np.newaxis] * th + np.arange(-1, th + 1)) % height
+        cols = (tj[:, np.newaxis] * tw + np.arange(-1, tw + 1)) % width
+        cells = rows[:, :, np.newaxis] * width + cols[:, np.newaxis, :]
+
+        # step the active tiles (with their halos) at once; the 3 x 3 sums
+        # are separable, and include the cell itself
+        front, back = self.boards[self.front], self.boards[1 - self.front]
+        tiles = np.take(front, cells)
+        sums = tiles[:, :, :-2] + tiles[:, :, 1:-1] + tiles[:, :, 2:]
+        sums = sums[:, :-2] + sums[:, 1:-1] + sums[:, 2:]
+        old = tiles[:, 1:-1, 1:-1]
+        new = ((sums == 3) | ((sums == 4) & (old == 1))).astype(np.uint8)
+        np.put(back, cells[:, 1:-1, 1:-1], new)
+        changed = (new != old).reshape((len(ti), th * tw)).any(axis=1)
+
+        self.dirty[:] = False
+        self.dirty[ti[changed], tj[changed]] = True
+        self.front = 1 - self.front
+        self.stats.append((len(ti), changed.sum()))
+        return self.board
+
+
+def render(board, out=None):
     """
-    Display state of game (of life)
+    Text frame of a board (one line per row), built at once: `out`, if
+    given, is a uint8 buffer of shape (height, width + 1) for the frame.
 
     """
 
-    for i in xrange(BOARD.shape[0]):
-        row = ""
-        for j in xrange(BOARD.shape[1]):
-            row += [DEAD_CHR, LIVE_CHR][BOARD[i, j]]
-        print row
+    height, width = board.shape
+    if out is None: out = np.empty((height, width + 1), dtype=np.uint8)
+    out[:, :width] = np.where(board, ord(LIVE_CHR), ord(DEAD_CHR))
+    out[:, width] = ord("\n")
+    return out.tobytes()
 
 
-def evolve(n_iter=-1, delay=0., n_iter_before_sleep=0):
+class Life(object):
     """
-    The main loop.
+    Game of Life on the torus.
 
     Parameters
     ----------
-    n_iter: int, optional (default -1)
-        Number of iterations to run. A negative value means "run forever".
+    board: 2D array of 0/1, optional (default None)
+        Initial board (copied).
+
+    shape: pair of integers, optional (default None)
+        Shape of the (empty) initial board, if `board` is not given.
 
-    delay: float, optional (default 0)
-        number of seconds to sleep between consecutive iterations.
+    engine: string, optional (default "swar")
+        "swar" for the bit-parallel engine (see `swar_step`), "sparse" for
+        the active-tiles one (see `SparseLife`), "naive" for the cell-by-cell
+        rules. All give the same generations.
+
+    tile_shape: pair of integers, optional (default (16, 16))
+        Tiles of the "sparse" engine.
+
+    Attributes
+    ----------
+    generation: int
+        Number of generations advanced so far.
 
     """
 
-    global BOARD
+    def __init__(self, board=None, shape=None, engine="swar",
+                 tile_shape=(16, 16)):
+        assert engine in ["swar", "sparse", "naive"]
+        if board is None: board = np.zeros(shape, dtype=np.uint8)
+        self.engine = engine
+        self.tile_shape = tile_shape
+        self.generation = 0
+        self.board = board
+
+    @property
+    def board(self):
+        if self.engine == "sparse": return self._sparse.board
+        if self._board is None:
+            self._board = unpack_board(self._words, self._width)
+        return self._board
+
+    @board.setter
+    def board(self, board):
+        board = (np.asarray(board) != 0).astype(np.uint8)
+        self._width = board.shape[1]
+        self._frame = np.empty((board.shape[0], board.shape[1] + 1),
+                               dtype=np.uint8)
+        self._board = board
+        if self.engine == "swar": self._words = pack_board(board)
+        elif self.engine == "sparse":
+            self._sparse = SparseLife(board, self.tile_shape)
+
+    @property
+    def stats(self):
+        """
+        Numbers of recomputed and changed tiles, at each generation (for the
+        "sparse" engine only).
+
+        """
+
+        return self._sparse.stats if self.engine == "sparse" else None
+
+    def step(self):
+        """
+        Advances the board one generation.
+
+        """
+
+        if self.engine == "swar":
+            # the board is only unpacked when it's looked at
+            self._words = swar_step(self._words, self._width)
+            self._board = None
+        elif self.engine == "sparse": self._sparse.step()
+        else: self._board = naive_step(self._board)
+        self.generation += 1
+        return self
+
+    def jump(self, n_gens, **kwargs):
+        """
+        Advances the board n_gens generations at once, with HashLife (see
+        `hashlife.HashLife`; kwargs are passed to it). HashLife runs on the
+        infinite plane, which is tiled with copies of the board far enough
+        around it that the torus is emulated for n_gens generations (see
+        `hashlife.HashLife.from_torus`): this is the same as stepping.
+
+        """
+
+        from hashlife import HashLife
+        generation = self.generation + n_gens
+        self.board = HashLife.from_torus(self.board, n_gens, **kwargs).advance(
+            n_gens).to_board()
+        self.generation = generation
+        return self
+
+    def display(self, stream=None):
+        """
+        Display state of game (of life), as one frame.
+
+        """
+
+        if stream is None: stream = sys.stdout
+        stream.write(render(self.board, out=self._frame))
+        stream.flush()
+
+    def evolve(self, n_iter=-1, delay=0., n_iter_before_sleep=0,
+               render_every=1, max_fps=None, stream=None, history=None):
+        """
+        The main loop.
+
+        Parameters
+        ----------
+        n_iter: int, optional (default -1)
+            Number of iterations to run. A negative value means "run
+            forever".
+
+        delay: float, optional (default 0)
+            number of seconds to sleep between consecutive iterations.
+
+        render_every: int, optional (default 1)
+            A frame is displayed every `render_every` generations (frame
+            skipping); 0 means no rendering at all (headless).
+
+        max_fps: float, optional (default None)
+            If given, frames are also skipped so as to display at most this
+            many frames per second.
+
+        stream: file-like, optional (default sys.stdout)
+            Where frames are written.
+
+        history: `spacetime.HistoryWriter`, optional (default None)
+            If given, each generation is appended to it before being
+            stepped; the loop stops early if it detects a cycle.
+
+        """
+
+        last = -np.inf
+        it = n_iter
+        while it:
+            if history is not None and history.append(self.board): break
+            if render_every and self.generation % render_every == 0:
+                now = time.time()
+                if max_fps is None or now - last >= 1. / max_fps:
+                    self.display(stream=stream)
+                    last = now
+            self.step()
+            if delay > 0 and n_iter - it > n_iter_before_sleep:
+                time.sleep(delay)
+            it -= 1
+        return self
+
+
+def benchmark(shape=(256, 256), n_iter_naive=2, n_iter_swar=1000, seed=0):
+    """
+    Compares the generations per second of the cell-by-cell and SWAR
+    engines, on a random board (and checks that they agree).
+
+    """
+
+    rng = np.random.RandomState(seed)
+    board = (rng.rand(*shape) > .7).astype(np.uint8)
+    naive = Life(board, engine="naive")
+    t0 = time.time()
+    naive.evolve(n_iter_naive, render_every=0)
+    naive_rate = n_iter_naive / (time.time() - t0)
+
+    swar = Life(board)
+    t0 = time.time()
+    swar.evolve(n_iter_swar, render_every=0)
+    swar_rate = n_iter_swar / (time.time() - t0)
+
+    swar = Life(board).evolve(n_iter_naive, render_every=0)
+    assert (swar.board == naive.board).all()
 
-    it = n_iter
-    while it:
-        display()
-        backup = np.zeros_like(BOARD)  # backup current state
-        for i in xrange(BOARD.shape[0]):
-            for j in xrange(BOARD.shape[1]): backup[i, j] = next_state((i, j))
-        BOARD = backup
-        if delay > 0 and n_iter - it > n_iter_before_sleep: time.sleep(delay)
-        it -= 1
+    print "%ix%i board: naive %.3g gen/s, SWAR %.3g gen/s (x%.0f)" % (
+        shape + (naive_rate, swar_rate, swar_rate / naive_rate))
+    return naive_rate, swar_rate
 
 
 if __name__ == "__main__":
     # make board
-    motive_size = BOARD.shape[0] // 2, BOARD.shape[1] // 2
+    height, width = terminal_size()
+    motive_size = height // 2, width // 2
     motive = np.zeros(motive_size, dtype=np.uint8)
     motive[np.random.randn(*motive_size) > .7] = 1
-    BOARD = np.hstack((motive, motive[:, ::-1]))
-    BOARD = np.vstack((BOARD, BOARD[::-1, :]))
+    board = np.hstack((motive, motive[:, ::-1]))
+    board = np.vstack((board, board[::-1, :]))
 
     # fire main loop
-    evolve()
+    Life(board).evolve()
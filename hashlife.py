@@ -0,0 +1,368 @@
+"""
+:Synopsis: HashLife: Game of Life on memoized quadtrees (Gosper's algorithm).
+:Author: DOHMATOB Elvis Dopgima <gmdopp@gmail.com> <elvis.dohmatob@inria.fr>
+
+The universe is a quadtree of hash-consed nodes: a node of level k is a
+2^k x 2^k square, and equal squares are the same node. Each node caches its
+centre 2^(k - 1) x 2^(k - 1) square, 2^j generations later (j <= k - 2);
+regular patterns then advance exponentially many generations at a time.
+
+Unlike the boards of `gameoflife`, the universe is the infinite plane (no
+toroidal wrap): a board imported with `HashLife.from_board` evolves like on
+the torus only as long as nothing crosses its edges, while one imported with
+`HashLife.from_torus` is tiled periodically far enough around its window to
+evolve like on the torus for a given number of generations.
+
+"""
+
+import numpy as np
+
+
+class Node(object):
+    """
+    Quadtree node of level k (a 2^k x 2^k square), with quadrants nw, ne, sw,
+    se of level k - 1 (None for the two level-0 cells).
+
+    """
+
+    __slots__ = ["level", "nw", "ne", "sw", "se", "pop", "cache", "stamp"]
+
+    def __init__(self, level, nw=None, ne=None, sw=None, se=None, pop=0,
+                 stamp=0):
+        self.level = level
+        self.nw, self.ne, self.sw, self.se = nw, ne, sw, se
+        self.pop = pop if level == 0 else nw.pop + ne.pop + sw.pop + se.pop
+        self.cache = {}
+        self.stamp = stamp
+
+
+class HashLife(object):
+    """
+    Game of Life universe, advanced with HashLife.
+
+    Parameters
+    ----------
+    max_nodes: int, optional (default 1 << 20)
+        When more nodes than this are interned, the node cache is garbage
+        collected, down to the nodes of the current universe and the most
+        recently used other ones (at most max_nodes / 2 in all, plus their
+        quadrants).
+
+    Attributes
+    ----------
+    root: `Node`
+        The universe.
+
+    origin: pair of integers
+        Coordinates (row, column) of the north-west corner of `root`.
+
+    generation: int
+        Number of generations advanced so far.
+
+    """
+
+    def __init__(self, max_nodes=1 << 20):
+        self.max_nodes = max_nodes
+        self.off, self.on = Node(0, pop=0), Node(0, pop=1)
+        self._table = {}
+        self._clock = 0
+        self._empty = [self.off]
+        self.root = self.empty(1)
+        self.origin = (0, 0)
+        self.generation = 0
+        self.window = None
+
+    def join(self, nw, ne, sw, se):
+        """
+        The (unique) node with quadrants nw, ne, sw, se.
+
+        """
+
+        key = (nw, ne, sw, se)
+        node = self._table.get(key)
+        if node is None:
+            node = self._table[key] = Node(nw.level + 1, nw, ne, sw, se,
+                                           stamp=self._clock)
+        return node
+
+    def empty(self, level):
+        """
+        The empty node of given level.
+
+        """
+
+        while len(self._empty) <= level:
+            e = self._empty[-1]
+            self._empty.append(self.join(e, e, e, e))
+        return self._empty[level]
+
+    def _centre(self, node):
+        return self.join(node.nw.se, node.ne.sw, node.sw.ne, node.se.nw)
+
+    def _horizontal(self, w, e):
+        return self.join(w.ne, e.nw, w.se, e.sw)
+
+    def _vertical(self, n, s):
+        return self.join(n.sw, n.se, s.nw, s.ne)
+
+    def _base(self, node):
+        """
+        Centre 2 x 2 square of a level-2 node, one generation later.
+
+        """
+
+        cells = []
+        for q, r in [(node.nw, node.ne), (node.sw, node.se)]:
+            cells.append([q.nw.pop, q.ne.pop, r.nw.pop, r.ne.pop])
+            cells.append([q.sw.pop, q.se.pop, r.sw.pop, r.se.pop])
+        cells = np.array(cells)
+        new = []
+        for i, j in [(1, 1), (1, 2), (2, 1), (2, 2)]:
+            count = cells[i - 1:i + 2, j - 1:j + 2].sum() - cells[i, j]
+            new.append(self.on if count == 3 or (
+                    count == 2 and cells[i, j]) else self.off)
+        return self.join(*new)
+
+    def _step(self, node, j):
+        """
+        Centre 2^(k - 1) x 2^(k - 1) square of a node of level k >= 2, 2^j
+        generations later (j <= k - 2).
+
+        """
+
+        k = node.level
+        if node.pop == 0: return self.empty(k - 1)
+        self._clock += 1
+        node.stamp = self._clock
+        result = node.cache.get(j)
+        if result is not None: return result
+        if k == 2:
+            result = self._base(node)
+        else:
+            nw, ne, sw, se = node.nw, node.ne, node.sw, node.se
+            subs = [[nw, self._horizontal(nw, ne), ne],
+                    [self._vertical(nw, sw), self._centre(node),
+                     self._vertical(ne, se)],
+                    [sw, self._horizontal(sw, se), se]]
+
+            # at full speed, both stages advance 2^(k - 3) generations;
+            # otherwise the first stage just crops
+            if j == k - 2: subs = [[self._step(sub, k - 3) for sub in row]
+                                   for row in subs]
+            else: subs = [[self._centre(sub) for sub in row] for row in subs]
+            j_ = min(j, k - 3)
+            result = self.join(*[
+                    self._step(self.join(subs[a][b], subs[a][b + 1],
+                                         subs[a + 1][b], subs[a + 1][b + 1]),
+                               j_) for a, b in [(0, 0), (0, 1), (1, 0),
+                                                (1, 1)]])
+        node.cache[j] = result
+        return result
+
+    def _expand(self):
+        # pad the universe with a border of empty quadrants
+        root = self.root
+        e = self.empty(root.level - 1)
+        self.root = self.join(self.join(e, e, e, root.nw),
+                              self.join(e, e, root.ne, e),
+                              self.join(e, root.sw, e, e),
+                              self.join(root.se, e, e, e))
+        half = 1 << (root.level - 1)
+        self.origin = (self.origin[0] - half, self.origin[1] - half)
+
+    def _padded(self):
+        # whether all the live cells are in the centre of the universe
+        root = self.root
+        return root.level >= 2 and root.pop == (
+            root.nw.se.pop + root.ne.sw.pop + root.sw.ne.pop +
+            root.se.nw.pop)
+
+    def jump(self, j):
+        """
+        Advances the universe 2^j generations.
+
+        """
+
+        while self.root.level < j + 2 or not self._padded(): self._expand()
+        self._expand()
+        level = self.root.level
+        self.root = self._step(self.root, j)
+        quarter = 1 << (level - 2)
+        self.origin = (self.origin[0] + quarter, self.origin[1] + quarter)
+        self.generation += 1 << j
+        if len(self._table) > self.max_nodes: self.collect()
+        return self
+
+    def advance(self, n_gens):
+        """
+        Advances the universe n_gens generations, 2^j generations at a time
+        for each bit j of n_gens.
+
+        """
+
+        j = 0
+        while n_gens:
+            if n_gens & 1: self.jump(j)
+            n_gens >>= 1
+            j += 1
+        return self
+
+    def collect(self):
+        """
+        Garbage collection of the node cache: the nodes of the universe, and
+        the most recently used (stepped or created) other ones, are kept,
+        together with their quadrants. Cached results which aren't kept
+        nodes are dropped, so that the rest can be freed.
+
+        Returns
+        -------
+        n_nodes: int
+            Number of nodes kept.
+
+        """
+
+        def _closure(stack, live):
+            while stack:
+                node = stack.pop()
+                if node.level == 0 or node in live: continue
+                live.add(node)
+                stack.extend([node.nw, node.ne, node.sw, node.se])
+            return live
+
+        live = _closure([self.root] + self._empty, set())
+        others = [node for node in self._table.itervalues()
+                  if node not in live]
+        budget = self.max_nodes // 2 - len(live)
+        if budget > 0:
+            others.sort(key=lambda node: node.stamp, reverse=True)
+            live = _closure(others[:budget], live)
+        self._table = dict(((node.nw, node.ne, node.sw, node.se), node)
+                           for node in live)
+        for node in live:
+            node.cache = dict((j, result) for j, result in
+                              node.cache.iteritems() if result in live)
+        return len(live)
+
+    @property
+    def population(self):
+        return self.root.pop
+
+    def _build(self, board, level):
+        if level == 0: return self.on if board[0, 0] else self.off
+        if not board.any(): return self.empty(level)
+        h = 1 << (level - 1)
+        return self.join(self._build(board[:h, :h], level - 1),
+                         self._build(board[:h, h:], level - 1),
+                         self._build(board[h:, :h], level - 1),
+                         self._build(board[h:, h:], level - 1))
+
+    @classmethod
+    def from_board(cls, board, origin=(0, 0), **kwargs):
+        """
+        Universe with the live cells of a 0/1 board (e.g
+        `gameoflife.Life.board`) and dead cells elsewhere; cell (i, j) of the
+        board is at (i, j) + origin. The board's window is remembered by
+        `to_board`.
+
+        """
+
+        self = cls(**kwargs)
+        board = np.asarray(board) != 0
+        level = 1
+        while (1 << level) < max(board.shape): level += 1
+        padded = np.zeros((1 << level, 1 << level), dtype=bool)
+        padded[:board.shape[0], :board.shape[1]] = board
+        self.root = self._build(padded, level)
+        self.origin = tuple(origin)
+        self.window = (tuple(origin), board.shape)
+        return self
+
+    @classmethod
+    def from_torus(cls, board, margin, **kwargs):
+        """
+        Universe tiled with copies of a 0/1 board, over at least `margin`
+        cells around the board's window (at the origin), and dead cells
+        beyond. For n_gens <= margin generations, the window then evolves
+        like the board on the torus (e.g in `gameoflife.Life`): the edges of
+        the tiling are too far to be felt there.
+
+        The copies are the same nodes wherever they line up with the
+        quadtree, and there are at most as many distinct nodes of each level
+        as cells in the board, so that this is cheap even for large margins.
+
+        """
+
+        self = cls(**kwargs)
+        board = np.asarray(board) != 0
+        height, width = board.shape
+        memo = {}
+
+        def _periodic(level, i, j):
+            # node of given level whose north-west corner is cell (i, j) of
+            # the board, in the periodic tiling
+            key = (level, i, j)
+            node = memo.get(key)
+            if node is None:
+                if level == 0: node = self.on if board[i, j] else self.off
+                else:
+                    h = 1 << (level - 1)
+                    i_, j_ = (i + h) % height, (j + h) % width
+                    node = self.join(_periodic(level - 1, i, j),
+                                     _periodic(level - 1, i, j_),
+                                     _periodic(level - 1, i_, j),
+                                     _periodic(level - 1, i_, j_))
+                memo[key] = node
+            return node
+
+        level = 1
+        while (1 << level) < 2 * margin + max(board.shape): level += 1
+        i0, j0 = ((1 << level) - height) // 2, ((1 << level) - width) // 2
+        self.root = _periodic(level, -i0 % height, -j0 % width)
+        self.origin = (-i0, -j0)
+        self.window = ((0, 0), board.shape)
+        return self
+
+    def _fill(self, node, i, j, out, i0, j0):
+        size = 1 << node.level
+        height, width = out.shape
+        if (node.pop == 0 or i >= i0 + height or j >= j0 + width or
+            i + size <= i0 or j + size <= j0): return
+        if node.level == 0:
+            out[i - i0, j - j0] = 1
+            return
+        h = size // 2
+        self._fill(node.nw, i, j, out, i0, j0)
+        self._fill(node.ne, i, j + h, out, i0, j0)
+        self._fill(node.sw, i + h, j, out, i0, j0)
+        self._fill(node.se, i + h, j + h, out, i0, j0)
+
+    def to_board(self, origin=None, shape=None):
+        """
+        The live cells in the window of given origin and shape (by default,
+        the window of the board given to `from_board`), as a uint8 board.
+
+        """
+
+        if origin is None: origin = self.window[0]
+        if shape is None: shape = self.window[1]
+        out = np.zeros(shape, dtype=np.uint8)
+        self._fill(self.root, self.origin[0], self.origin[1], out, *origin)
+        return out
+
+
+if __name__ == "__main__":
+    import time
+
+    # mirrored random motive, as in gameoflife
+    motive = np.zeros((64, 64), dtype=np.uint8)
+    motive[np.random.randn(*motive.shape) > .7] = 1
+    board = np.hstack((motive, motive[:, ::-1]))
+    board = np.vstack((board, board[::-1, :]))
+
+    life = HashLife.from_board(board, max_nodes=1 << 18)
+    for n_gens in [1, 10, 100, 1000, 10000, 100000]:
+        t0 = time.time()
+        life.advance(n_gens - life.generation)
+        print "generation %i: population %i, %i nodes (%.2fs)" % (
+            life.generation, life.population, len(life._table),
+            time.time() - t0)
@@ -1,17 +1,20 @@
 from core import metropolis_hastings, MarkovChain
+import numpy as np
 import pylab as pl
 
 
 if __name__ == "__main__":
     q = MarkovChain(trans_table=[[.5, .5], [.4, .6]])
 
-    # one can easily show (linear algebra) that the MC above
-    # has the following limiting distro:
-    p = lambda x: [4. / 9, 5. / 9][0 if x is None else x]
+    # limiting distro of the MC above (namely [4 / 9, 5 / 9]), and a
+    # warm-up long enough for it to mix
+    pi = q.stationary_distribution()
+    p = lambda x: pi[0 if x is None else x]
+    lag = int(np.ceil(q.mixing_time_bounds()[1]))
 
     pl.close("all")
     for i in xrange(3):
-        samples = [x for x in metropolis_hastings(p, q, 1000)]
+        samples = [x for x in metropolis_hastings(p, q, 1000, lag=lag)]
         pl.figure()
         ax = pl.subplot(111)
         pl.title("clone %i" % i)
@@ -0,0 +1,168 @@
+"""
+:Synopsis: Space-time histories of cellular automata, on disk.
+:Author: DOHMATOB Elvis Dopgima <gmdopp@gmail.com> <elvis.dohmatob@inria.fr>
+
+A history is a sequence of generations (0/1 arrays of a fixed shape, e.g a
+row of an elementary CA, a batch of such rows, or a Game of Life board).
+Generations are bit-packed along their last axis (`np.packbits`) and
+appended, in chunks, to a raw data file, which is read back as a
+`np.memmap`: arbitrary ranges of generations are then sliced without loading
+the whole file. The shape of the generations and their number are kept in a
+JSON file next to the data (path + ".json").
+
+"""
+
+import json
+import hashlib
+import numpy as np
+
+
+def _meta_path(path):
+    return path + ".json"
+
+
+class HistoryWriter(object):
+    """
+    Appends generations to a history file.
+
+    Parameters
+    ----------
+    path: string
+        Path of the data file (overwritten).
+
+    shape: tuple of integers
+        Shape of each generation.
+
+    chunk_size: int, optional (default 1024)
+        Number of generations buffered in memory between writes to disk.
+
+    detect_cycles: bool, optional (default False)
+        If set, each generation is hashed, and `append` reports when it
+        repeats an earlier one (from then on, the run is periodic).
+
+    Attributes
+    ----------
+    n_gens: int
+        Number of generations appended so far.
+
+    cycle: pair of integers, or None
+        (first generation of the cycle, period), once a cycle is detected.
+
+    """
+
+    def __init__(self, path, shape, chunk_size=1024, detect_cycles=False):
+        self.path = path
+        self.shape = tuple(shape)
+        self.packed_shape = self.shape[:-1] + ((self.shape[-1] + 7) // 8,)
+        self.chunk_size = chunk_size
+        self.detect_cycles = detect_cycles
+        self.n_gens = 0
+        self.cycle = None
+        self._chunk = np.empty((chunk_size,) + self.packed_shape,
+                               dtype=np.uint8)
+        self._pending = 0
+        self._seen = {}
+        self._file = open(path, "wb")
+        self._write_meta()
+
+    def _write_meta(self):
+        with open(_meta_path(self.path), "w") as fd:
+            json.dump(dict(shape=list(self.shape), n_gens=self.n_gens,
+                           cycle=self.cycle), fd)
+
+    def append(self, generation):
+        """
+        Appends a generation.
+
+        Returns
+        -------
+        repeated: bool
+            Whether (when detecting cycles) the generation repeats an
+            earlier one; `cycle` is then set.
+
+        """
+
+        generation = np.asarray(generation)
+        assert generation.shape == self.shape, (
+            "expected a generation of shape %s, got %s" % (
+                self.shape, generation.shape))
+        packed = self._chunk[self._pending]
+        packed[...] = np.packbits(generation != 0, axis=-1)
+        self._pending += 1
+        self.n_gens += 1
+        if self._pending == self.chunk_size: self.flush()
+
+        if self.detect_cycles:
+            key = hashlib.sha1(packed.tobytes()).digest()
+            first = self._seen.setdefault(key, self.n_gens - 1)
+            if first < self.n_gens - 1:
+                if self.cycle is None:
+                    self.cycle = (first, self.n_gens - 1 - first)
+                return True
+        return False
+
+    def extend(self, generations):
+        """
+        Appends generations, stopping after the first repeated one (when
+        detecting cycles).
+
+        Returns
+        -------
+        repeated: bool
+            Whether a repeated generation was met.
+
+        """
+
+        for generation in generations:
+            if self.append(generation): return True
+        return False
+
+    def flush(self):
+        """
+        Writes the buffered generations to disk.
+
+        """
+
+        if self._pending:
+            self._file.write(self._chunk[:self._pending].tobytes())
+            self._pending = 0
+        self._file.flush()
+        self._write_meta()
+
+    def close(self):
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HistoryReader(object):
+    """
+    Random access to a history file written by `HistoryWriter`: `reader[i]`
+    is generation i, and `reader[start:stop:step]` an array of generations,
+    unpacked from a memory-map of the file (only the sliced generations are
+    read).
+
+    """
+
+    def __init__(self, path):
+        with open(_meta_path(path)) as fd: meta = json.load(fd)
+        self.path = path
+        self.shape = tuple(meta["shape"])
+        self.n_gens = meta["n_gens"]
+        self.cycle = None if meta["cycle"] is None else tuple(meta["cycle"])
+        self.packed_shape = self.shape[:-1] + ((self.shape[-1] + 7) // 8,)
+        self._data = np.memmap(path, dtype=np.uint8, mode="r", shape=(
+                self.n_gens,) + self.packed_shape) if self.n_gens else (
+            np.zeros((0,) + self.packed_shape, dtype=np.uint8))
+
+    def __len__(self):
+        return self.n_gens
+
+    def __getitem__(self, item):
+        packed = self._data[item]
+        return np.unpackbits(packed, axis=-1)[..., :self.shape[-1]]
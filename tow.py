@@ -4,13 +4,11 @@
 
 """
 
+import time
 import numpy as np
-from joblib import Memory
-import tempfile
-from core import flip
+from core import flip, mem, MemScope, query
 
-mem = Memory(tempfile.mkdtemp(prefix="tow"), verbose=-1)
-strength = lambda person: 10 if mem.cache(flip)(person=person) else 5
+strength = mem(lambda person: 10 if flip() else 5)
 lazy = lambda _: flip(1. / 3)
 pull = lambda person: .5 * strength(person) if lazy(
   person) else strength(person)
@@ -18,10 +16,62 @@ total_pulling = lambda team: np.sum(map(pull, team))
 winner = lambda team1, team2: team2 if total_pulling(team1) < total_pulling(
   team2) else team1
 
-print [winner(*competitors)
-       for competitors in [(("alice", "bob"), ("sue", "tom")),
-                           (("alice", "bob"), ("sue", "tom")),
-                           (("alice", "sue"), ("bob", "tom")),
-                           (("alice", "sue"), ("bob", "tom")),
-                           (("alice", "tom"), ("bob", "sue")),
-                           (("alice", "tom"), ("bob", "sue"))]]
+
+def alice_strong_given_two_wins(worlds):
+    """
+    The model, on many worlds at once (see `core.query`): is alice strong,
+    given that alice and bob beat sue and tom twice?
+
+    """
+
+    strength = worlds.mem(lambda person: np.where(worlds.flip(), 10, 5))
+    lazy = lambda _: worlds.flip(1. / 3)
+    pull = lambda person: np.where(lazy(person), .5, 1.) * strength(person)
+    total_pulling = lambda team: sum(map(pull, team))
+    beats = lambda team1, team2: total_pulling(team1) >= total_pulling(team2)
+
+    teams = ("alice", "bob"), ("sue", "tom")
+    worlds.condition(beats(*teams) & beats(*teams))
+    return strength("alice") == 10
+
+
+def naive_alice_strong_given_two_wins(n_worlds):
+    """
+    Same query, by rejection sampling one world at a time.
+
+    """
+
+    scope = MemScope()
+    strength = mem(lambda person: 10 if flip() else 5, scope=scope)
+    pull = lambda person: .5 * strength(person) if flip(1. / 3) else (
+        strength(person))
+    total_pulling = lambda team: np.sum(map(pull, team))
+    teams = ("alice", "bob"), ("sue", "tom")
+    n_accepted = n_strong = 0
+    for _ in xrange(n_worlds):
+        with scope:
+            if all(total_pulling(teams[0]) >= total_pulling(teams[1])
+                   for _ in xrange(2)):
+                n_accepted += 1
+                n_strong += strength("alice") == 10
+    return 1. * n_strong / n_accepted, n_accepted
+
+
+if __name__ == "__main__":
+    print [winner(*competitors)
+           for competitors in [(("alice", "bob"), ("sue", "tom")),
+                               (("alice", "bob"), ("sue", "tom")),
+                               (("alice", "sue"), ("bob", "tom")),
+                               (("alice", "sue"), ("bob", "tom")),
+                               (("alice", "tom"), ("bob", "sue")),
+                               (("alice", "tom"), ("bob", "sue"))]]
+
+    for name, run, n_worlds in [
+        ("naive", naive_alice_strong_given_two_wins, 20000),
+        ("vectorized", lambda n: query(alice_strong_given_two_wins,
+                                       n_worlds=n), 1000000)]:
+        t0 = time.time()
+        p, n_eff = run(n_worlds)
+        print ("%s: P(alice strong | alice & bob won twice) = %.3f (%i "
+               "worlds accepted), %.0f worlds/s") % (
+            name, p, n_eff, n_worlds / (time.time() - t0))